@@ -21,9 +21,7 @@
 import base64
 from common.ipaddresspair import IPAddressPair
 from email.message import EmailMessage
-from functools import wraps
 import gevent
-import inspect
 import itertools
 import json
 import logging
@@ -37,6 +35,7 @@ from common.errors import FatalError, MajorError
 from common.connectionhandler import PeerConnectedMessage, PeerDisconnectedMessage
 from common.loginprotocol import LoginProtocolMessage
 from common.messages import *
+from common.packethandlers import HandlerRegistry, handles
 from common.statetracer import statetracer
 
 from .communityloginserverhandler import CommunityLoginServer
@@ -56,24 +55,6 @@ class NoPublicIpAddressError(FatalError):
         super().__init__(f'Failed to detect the public IP address: {error}. Authbot refuses to start up without it, because it needs this IP address when sending verification mail.')
 
 
-def handles(packet):
-    """
-    A decorator that defines a function as a handler for a certain packet
-    :param packet: the packet being handled by the function
-    """
-
-    def real_decorator(func):
-        func.handles_packet = packet
-
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            return func(*args, **kwargs)
-
-        return wrapper
-
-    return real_decorator
-
-
 def xor_password_hash(password_hash, salt):
     salt_nibbles = []
     for value in salt:
@@ -129,7 +110,7 @@ def xor_password_hash(password_hash, salt):
 
 
 @statetracer()
-class AuthBot:
+class AuthBot(HandlerRegistry):
     def __init__(self, config, incoming_queue):
         gevent.getcurrent().name = 'authbot'
 
@@ -331,21 +312,13 @@ class AuthBot:
     def handle_login_protocol_message(self, msg):
         msg.peer.last_received_seq = msg.clientseq
 
-        requests = ' '.join(['%04X' % req.ident for req in msg.requests])
-
         for request in msg.requests:
-            methods = [
-                func for name, func in inspect.getmembers(self) if
-                getattr(func, 'handles_packet', None) == type(request)
-            ]
-            if not methods:
+            handler = self.packet_handlers.get(type(request))
+            if handler is None:
                 self.logger.warning("No handler found for request %s" % request)
                 return
 
-            if len(methods) > 1:
-                raise ValueError("Duplicate handlers found for request")
-
-            methods[0](request)
+            handler(self, request)
 
     @handles(packet=a01bc)
     def handle_a01bc(self, request):
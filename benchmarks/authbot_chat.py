@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Measures how long the authbot takes to handle private chat messages that it
+receives from the HiRez login server.
+
+A few thousand a0070 chat messages with a mix of commands are replayed
+through AuthBot.handle_login_protocol_message. The authbot is created
+without running its __init__, so no connections or IP address detection are
+needed, and its login servers are replaced by stubs that only collect what
+would have been sent. For comparison the same handlers are also called
+through the inspect.getmembers lookup that the authbot used to do for every
+request.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.authbot_chat
+"""
+
+import argparse
+import inspect
+import logging
+import time
+
+from authbot.authbot import AuthBot
+from common.datatypes import *
+from common.loginprotocol import LoginProtocolMessage
+
+
+class StubLoginServer:
+    def __init__(self):
+        self.last_received_seq = None
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+
+def create_authbot():
+    authbot = AuthBot.__new__(AuthBot)
+    authbot.logger = logging.getLogger('benchmark')
+    authbot.hirez_login_server = StubLoginServer()
+    authbot.community_login_server = StubLoginServer()
+    authbot.display_name = 'authbot'
+    authbot.last_requests = {}
+    return authbot
+
+
+def create_chat_messages(count):
+    texts = ['hi', 'authcode player%d@example.com', 'authcode not-an-email', 'setemail player%d@example.com']
+    messages = []
+    for i in range(count):
+        text = texts[i % len(texts)]
+        if '%d' in text:
+            text = text % i
+        request = a0070().set([
+            m009e().set(MESSAGE_PRIVATE),
+            m02e6().set(text),
+            m02fe().set('player%d' % (i % 500)),
+        ])
+        messages.append(LoginProtocolMessage(i, [request]))
+    return messages
+
+
+def handle_with_getmembers(authbot, msg):
+    msg.peer.last_received_seq = msg.clientseq
+    for request in msg.requests:
+        methods = [
+            func for name, func in inspect.getmembers(authbot) if
+            getattr(func, 'handles_packet', None) == type(request)
+        ]
+        methods[0](request)
+
+
+def measure(handle, messages, repeat):
+    best = None
+    for _ in range(repeat):
+        authbot = create_authbot()
+        for msg in messages:
+            msg.peer = authbot.hirez_login_server
+        start = time.perf_counter()
+        for msg in messages:
+            handle(authbot, msg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chat message handling in the authbot')
+    parser.add_argument('--messages', type=int, default=5000, help='number of chat messages to replay')
+    parser.add_argument('--repeat', type=int, default=5, help='number of replays, of which the fastest is reported')
+    args = parser.parse_args()
+
+    messages = create_chat_messages(args.messages)
+
+    for name, handle in (('dispatch table', AuthBot.handle_login_protocol_message),
+                         ('inspect.getmembers', handle_with_getmembers)):
+        elapsed = measure(handle, messages, args.repeat)
+        print('%-20s %8.2f us/message %10.0f messages/s' %
+              (name, elapsed / len(messages) * 1e6, len(messages) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures decoding and encoding of login protocol messages from real traffic.
+
+By default the bundled capture of the login sequence is used. Dumps made by
+the login server's TrafficDumper (taserverdump.carrays) can be given as
+additional inputs, in which case both directions of the dumped traffic are
+benchmarked. A dump should contain the traffic of a single client, because
+the dumper does not record which connection a packet belongs to.
+
+For every top level message type this reports decoded and encoded messages
+per second and megabytes per second, as well as the number of memory blocks
+that a decoded message keeps allocated and the peak memory used while
+decoding it.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.codec [taserverdump.carrays ...]
+"""
+
+import argparse
+import collections
+import io
+import struct
+import time
+import tracemalloc
+
+from common.datatypes import ParseError
+from common.loginprotocol import PacketReader, StreamParser
+from scripts.parse import carrays2indentandbytesperblock, removepacketsizes
+
+CAPTURE_FILE = 'resources/tribescapture.bin.stripped'
+MAX_FRAME_SIZE = 1450
+
+
+def split_into_messages(data):
+    """ Returns the bytes of every message in a stream of login protocol payloads """
+    frames = iter([data[i:i + MAX_FRAME_SIZE] for i in range(0, len(data), MAX_FRAME_SIZE)])
+    received_length = 0
+
+    def receive():
+        nonlocal received_length
+        frame = next(frames, None)
+        if frame is None:
+            raise EOFError
+        received_length += len(frame)
+        return frame
+
+    reader = PacketReader(receive)
+    parser = StreamParser(reader)
+    messages = []
+    start = 0
+    while start < len(data):
+        try:
+            parser.parse()
+        except EOFError:
+            print('  ignoring incomplete message at offset 0x%X' % start)
+            break
+        except (ParseError, KeyError) as e:
+            print('  stopped at offset 0x%X, because the message there could not be parsed: %r' % (start, e))
+            break
+        end = received_length - reader.available()
+        messages.append(data[start:end])
+        start = end
+    return messages
+
+
+def decode(message_bytes):
+    return StreamParser(PacketReader(lambda: message_bytes)).parse()
+
+
+def encode(seq, objs):
+    stream = io.BytesIO()
+    for obj in objs:
+        obj.write(stream)
+    if seq is not None:
+        stream.write(struct.pack('<LL', seq, 0))
+    return stream.getvalue()
+
+
+def load_capture():
+    with open(CAPTURE_FILE, 'rb') as f:
+        return {'capture (server to client)': f.read()}
+
+
+def load_carrays_dump(filename):
+    data = {False: io.BytesIO(), True: io.BytesIO()}
+    with open(filename, 'rt') as infile:
+        for from_server, hex_bytes in carrays2indentandbytesperblock(infile):
+            data[from_server].write(bytes(hex_bytes))
+
+    streams = {}
+    for from_server, direction in ((False, 'client to server'), (True, 'server to client')):
+        data[from_server].seek(0)
+        _, payload = removepacketsizes(from_server, data[from_server])
+        streams['%s (%s)' % (filename, direction)] = payload.getvalue()
+    return streams
+
+
+def measure(messages, repeat):
+    """ Returns decode time, encode time, retained blocks and peak bytes for a list of messages """
+    decoded = [decode(message_bytes) for message_bytes in messages]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for message_bytes in messages:
+            decode(message_bytes)
+    decode_time = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for seq, objs in decoded:
+            encode(seq, objs)
+    encode_time = (time.perf_counter() - start) / repeat
+
+    retained_blocks = 0
+    peak_bytes = 0
+    tracemalloc.start()
+    for message_bytes in messages:
+        tracemalloc.reset_peak()
+        before_snapshot = tracemalloc.take_snapshot()
+        before_size, _ = tracemalloc.get_traced_memory()
+        result = decode(message_bytes)
+        _, peak_size = tracemalloc.get_traced_memory()
+        after_snapshot = tracemalloc.take_snapshot()
+        retained_blocks += sum(stat.count_diff for stat in after_snapshot.compare_to(before_snapshot, 'filename'))
+        peak_bytes += peak_size - before_size
+        del result
+    tracemalloc.stop()
+
+    return decode_time, encode_time, retained_blocks, peak_bytes
+
+
+def report(name, messages, repeat):
+    by_type = collections.defaultdict(list)
+    for message_bytes in messages:
+        ident = struct.unpack('<H', message_bytes[:2])[0]
+        by_type[ident].append(message_bytes)
+
+    print()
+    print('%s: %d messages, %d bytes' % (name, len(messages), sum(len(m) for m in messages)))
+    print('  %-6s %5s %9s | %12s %9s | %12s %9s | %11s %11s' %
+          ('type', 'count', 'bytes',
+           'decode msg/s', 'MB/s', 'encode msg/s', 'MB/s',
+           'blocks/msg', 'peak B/msg'))
+
+    total_decode_time = total_encode_time = 0.0
+    for ident, type_messages in sorted(by_type.items()):
+        decode_time, encode_time, retained_blocks, peak_bytes = measure(type_messages, repeat)
+        total_decode_time += decode_time
+        total_encode_time += encode_time
+        count = len(type_messages)
+        size = sum(len(m) for m in type_messages)
+        print('  0x%04X %5d %9d | %12.0f %9.2f | %12.0f %9.2f | %11.1f %11.0f' %
+              (ident, count, size,
+               count / decode_time, size / decode_time / 1e6,
+               count / encode_time, size / encode_time / 1e6,
+               retained_blocks / count, peak_bytes / count))
+
+    count = len(messages)
+    size = sum(len(m) for m in messages)
+    print('  %-6s %5d %9d | %12.0f %9.2f | %12.0f %9.2f |' %
+          ('total', count, size,
+           count / total_decode_time, size / total_decode_time / 1e6,
+           count / total_encode_time, size / total_encode_time / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the login protocol codec on recorded traffic')
+    parser.add_argument('dumps', metavar='DUMP', nargs='*',
+                        help='traffic dump in C-arrays format, as written by the login server\'s TrafficDumper')
+    parser.add_argument('--repeat', type=int, default=20, help='number of times every message is decoded and encoded')
+    parser.add_argument('--no-capture', action='store_true', help='do not benchmark the bundled capture')
+    args = parser.parse_args()
+
+    streams = {} if args.no_capture else load_capture()
+    for dump in args.dumps:
+        streams.update(load_carrays_dump(dump))
+
+    for name, data in streams.items():
+        messages = split_into_messages(data)
+        if messages:
+            report(name, messages, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures how long it takes to encode an a00d5 server list.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.encode_server_list
+"""
+
+import argparse
+import io
+from ipaddress import IPv4Address
+import struct
+import timeit
+
+from common.datatypes import *
+from common.ipaddresspair import IPAddressPair
+
+
+class BenchmarkGameServer:
+    def __init__(self, server_id):
+        self.server_id = server_id
+        self.joinable = True
+        self.players = {player_id: None for player_id in range(server_id % 24)}
+        self.region = REGION_EUROPE
+        self.password_hash = None if server_id % 5 else b'secret'
+        self.game_setting_mode = 'ootb'
+        self.description = 'Benchmark server %d' % server_id
+        self.motd = 'Welcome to benchmark server %d' % server_id
+        self.map_id = 1456
+        self.be_score = server_id % 3
+        self.ds_score = server_id % 7
+        self.address_pair = IPAddressPair(IPv4Address('80.100.0.%d' % server_id), None)
+        self.port = 7777
+        self.pingport = 9002
+
+    def get_time_remaining(self):
+        return 600
+
+
+def create_game_servers(count):
+    return [BenchmarkGameServer(server_id) for server_id in range(1, count + 1)]
+
+
+def write_per_field(stream, field):
+    """ Encode a message the way it was done before fixed layouts, one struct.pack and write per field """
+    if isinstance(field, enumblockarray):
+        stream.write(struct.pack('<HH', field.ident, len(field.content)))
+        for el in field.content:
+            write_per_field(stream, el)
+    elif isinstance(field, arrayofenumblockarrays) and not field.original_bytes:
+        stream.write(struct.pack('<HH', field.ident, len(field.arrays)))
+        for arr in field.arrays:
+            stream.write(struct.pack('<H', len(arr)))
+            for el in arr:
+                write_per_field(stream, el)
+    else:
+        field.write(stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark encoding of the a00d5 server list')
+    parser.add_argument('--servers', type=int, default=50, help='number of game servers in the list')
+    parser.add_argument('--repeat', type=int, default=2000, help='number of encodes per measurement')
+    args = parser.parse_args()
+
+    servers = create_game_servers(args.servers)
+    player_address = IPAddressPair(IPv4Address('80.101.0.1'), None)
+    msg = a00d5().setservers(servers, player_address)
+
+    def encode_per_field():
+        write_per_field(io.BytesIO(), msg)
+
+    def encode_fixed_layout():
+        msg.write(io.BytesIO())
+
+    rows = [serverlistrow(server, player_address) for server in servers]
+
+    def encode_cached_rows():
+        a00d5().setserverrows(row.fill(server.get_time_remaining())
+                              for row, server in zip(rows, servers)).write(io.BytesIO())
+
+    per_field_stream = io.BytesIO()
+    write_per_field(per_field_stream, msg)
+    fixed_layout_stream = io.BytesIO()
+    msg.write(fixed_layout_stream)
+    assert per_field_stream.getvalue() == fixed_layout_stream.getvalue()
+    cached_rows_stream = io.BytesIO()
+    a00d5().setserverrows(row.fill(server.get_time_remaining())
+                          for row, server in zip(rows, servers)).write(cached_rows_stream)
+    assert cached_rows_stream.getvalue() == fixed_layout_stream.getvalue()
+
+    per_field_time = min(timeit.repeat(encode_per_field, number=args.repeat, repeat=5)) / args.repeat
+    fixed_layout_time = min(timeit.repeat(encode_fixed_layout, number=args.repeat, repeat=5)) / args.repeat
+    cached_rows_time = min(timeit.repeat(encode_cached_rows, number=args.repeat, repeat=5)) / args.repeat
+
+    print('a00d5 with %d servers (%d bytes)' % (args.servers, len(fixed_layout_stream.getvalue())))
+    print('  per-field encode:    %8.1f us' % (per_field_time * 1e6))
+    print('  fixed-layout encode: %8.1f us' % (fixed_layout_time * 1e6))
+    print('  cached rows encode:  %8.1f us' % (cached_rows_time * 1e6))
+    print('  speedup:             %8.2fx (fixed layout), %.2fx (cached rows)' %
+          (per_field_time / fixed_layout_time, per_field_time / cached_rows_time))
+
+
+if __name__ == '__main__':
+    main()
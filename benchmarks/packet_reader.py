@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Compares the PacketReader against the one it replaced by parsing the
+captured login sequence, received in frames of at most 1450 bytes.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.packet_reader
+"""
+
+import argparse
+import timeit
+
+from common.loginprotocol import PacketReader, StreamParser
+
+CAPTURE_FILE = 'resources/tribescapture.bin.stripped'
+
+
+class LegacyPacketReader:
+    """ The PacketReader as it was before, which copies the rest of the buffer on every read """
+    def __init__(self, receive_func):
+        self.buffer = bytes()
+        self.receive_func = receive_func
+
+    def prepare(self, length):
+        while len(self.buffer) < length:
+            message_data = self.receive_func()
+            self.buffer += message_data
+
+    def read(self, length):
+        self.prepare(length)
+        requestedbytes = self.buffer[:length]
+        self.buffer = self.buffer[length:]
+        return requestedbytes
+
+    def peek(self, length):
+        self.prepare(length)
+        requestedbytes = self.buffer[:length]
+        return requestedbytes
+
+    def available(self):
+        return len(self.buffer)
+
+    def tell(self):
+        return 0
+
+
+def parse_all(reader_class, frames):
+    frame_iter = iter(frames)
+
+    def receive():
+        try:
+            return next(frame_iter)
+        except StopIteration:
+            raise EOFError
+
+    parser = StreamParser(reader_class(receive))
+    message_count = 0
+    try:
+        while True:
+            parser.parse()
+            message_count += 1
+    except EOFError:
+        pass
+    return message_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsing of the captured login sequence')
+    parser.add_argument('--repeat', type=int, default=20, help='number of parses per measurement')
+    parser.add_argument('--frame-size', type=int, default=1450, help='size of the received frames')
+    args = parser.parse_args()
+
+    with open(CAPTURE_FILE, 'rb') as f:
+        data = f.read()
+    frames = [data[i:i + args.frame_size] for i in range(0, len(data), args.frame_size)]
+
+    message_count = parse_all(PacketReader, frames)
+    assert parse_all(LegacyPacketReader, frames) == message_count
+
+    print('%d messages, %d bytes in %d frames' % (message_count, len(data), len(frames)))
+    times = {}
+    for reader_class in (LegacyPacketReader, PacketReader):
+        times[reader_class] = min(timeit.repeat(lambda: parse_all(reader_class, frames),
+                                                number=args.repeat, repeat=5)) / args.repeat
+        print('  %-20s %8.2f ms' % (reader_class.__name__, times[reader_class] * 1000))
+    print('  speedup:             %8.2fx' % (times[LegacyPacketReader] / times[PacketReader]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Simulates a reconnect storm on the social network, as happens when the login
+server is restarted and all players log in again at about the same time.
+
+Every player comes online with a friend list of realistic size, requests
+its friend list and half of them then join a game server. Notifications are
+flushed after each of these, like the login server does after handling a
+message. The time taken by the social network, including building the
+notifications, is reported along with how many messages the batching of
+notifications saved.
+With --compare the same storm is also run against the follower lookup that
+scans the friend lists of all players, which is quadratic in the number of
+players and therefore takes a long time with the default player count.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.social_network [--players N] [--compare]
+"""
+
+import argparse
+import random
+import time
+
+from login_server.social_network import SocialNetwork
+
+
+class BenchmarkPlayer:
+    def __init__(self, unique_id):
+        self.unique_id = unique_id
+        self.login_name = 'player%d' % unique_id
+        self.verified = True
+        self.messages_received = 0
+
+    def send(self, msg):
+        self.messages_received += 1
+
+
+class ScanningSocialNetwork(SocialNetwork):
+    """ Looks up followers by going through the friends of every player, like before the follower map """
+    def _get_followers(self, selected_player_id):
+        return {player_id for player_id, friends in
+                self.player_friends.items() if selected_player_id in friends}
+
+
+def create_friend_lists(player_count, min_friends, max_friends, seed):
+    rng = random.Random(seed)
+    player_ids = list(range(1, player_count + 1))
+    return {player_id: {friend_id: 'player%d' % friend_id
+                        for friend_id in rng.sample(player_ids, rng.randint(min_friends, max_friends))
+                        if friend_id != player_id}
+            for player_id in player_ids}
+
+
+def reconnect_storm(social_network, friend_lists, seed):
+    players = [BenchmarkPlayer(player_id) for player_id in friend_lists]
+    random.Random(seed).shuffle(players)
+
+    start = time.perf_counter()
+    for player in players:
+        social_network.notify_online(player, friend_lists[player.unique_id])
+        social_network.flush_notifications()
+        social_network.send_friend_list(player.unique_id)
+    for player in players[::2]:
+        social_network.notify_on_game_server(player)
+        social_network.flush_notifications()
+    elapsed = time.perf_counter() - start
+
+    return elapsed, sum(player.messages_received for player in players), social_network.messages_saved()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the social network during a reconnect storm')
+    parser.add_argument('--players', type=int, default=10000, help='number of players that reconnect')
+    parser.add_argument('--min-friends', type=int, default=5, help='minimum number of friends per player')
+    parser.add_argument('--max-friends', type=int, default=50, help='maximum number of friends per player')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the friend lists and reconnect order')
+    parser.add_argument('--compare', action='store_true', help='also run the storm with the scanning follower lookup')
+    args = parser.parse_args()
+
+    friend_lists = create_friend_lists(args.players, args.min_friends, args.max_friends, args.seed)
+    print('%d players with %d friends on average' %
+          (args.players, sum(len(friends) for friends in friend_lists.values()) / args.players))
+
+    networks = [('follower map', SocialNetwork)]
+    if args.compare:
+        networks.append(('scanning lookup', ScanningSocialNetwork))
+
+    for name, network_class in networks:
+        elapsed, messages, saved = reconnect_storm(network_class(), friend_lists, args.seed)
+        print('%-16s %8.2f s %10d messages sent %10d saved %8.1f us/player' %
+              (name, elapsed, messages, saved, elapsed / args.players * 1e6))
+
+
+if __name__ == '__main__':
+    main()
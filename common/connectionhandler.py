@@ -18,6 +18,7 @@
 # along with taserver.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from collections import Counter
 import logging
 
 import gevent.queue
@@ -80,21 +81,44 @@ class ConnectionReader:
 
 
 class TcpMessageConnectionReader(ConnectionReader):
-    def __init__(self, sock, max_message_size = 0xFFFF, dump_queue = None, token_bucket: TokenBucket = None):
+    def __init__(self, sock, max_message_size = 0xFFFF, dump_queue = None, token_bucket: TokenBucket = None,
+                 buffered = False):
         super().__init__(sock)
-        self.tcp_reader = TcpMessageReader(sock, max_message_size = max_message_size, dump_queue = dump_queue, token_bucket=token_bucket)
+        self.tcp_reader = TcpMessageReader(sock, max_message_size = max_message_size, dump_queue = dump_queue,
+                                           token_bucket=token_bucket, buffered=buffered)
 
     def receive(self):
         return self.tcp_reader.receive()
 
 
+# Totals of what all ConnectionWriters sent, so that the effect of
+# coalescing can be followed while the writers are still running
+connection_writer_counters = Counter()
+
+
 class ConnectionWriter:
-    def __init__(self, sock):
+    """
+    Takes messages from the outgoing queue, encodes them and sends them.
+
+    In coalescing mode the writer also takes all messages that are already
+    waiting in the queue (up to coalesce_max_bytes of encoded data) whenever
+    it wakes up, and sends them with a single call to send_multiple. With a
+    coalesce_delay it first waits that many seconds for more messages to
+    arrive.
+    """
+    def __init__(self, sock, coalesce=False, coalesce_max_bytes=0x10000, coalesce_delay=0):
         self.logger = logging.getLogger(__name__)
         self.task_name = None
         self.task_id = None
         self.outgoing_queue = None
         self.sock = sock
+        self.coalesce = coalesce
+        self.coalesce_max_bytes = coalesce_max_bytes
+        self.coalesce_delay = coalesce_delay
+
+        self.messages_sent = 0
+        self.sends = 0
+        self.bytes_sent = 0
 
     def run(self):
         gevent.getcurrent().name = self.task_name
@@ -102,15 +126,30 @@ class ConnectionWriter:
             msg = self.outgoing_queue.get()
             if not isinstance(msg, PeerDisconnectedMessage):
                 try:
-                    msg_bytes = self.encode(msg)
-                    self.send(msg_bytes)
-                except (ConnectionResetError, ConnectionAbortedError):
+                    msgs_bytes = [self.encode(msg)]
+                    if self.coalesce:
+                        msg = self._encode_queued_messages(msgs_bytes)
+                    if len(msgs_bytes) == 1:
+                        self.send(msgs_bytes[0])
+                    else:
+                        self.send_multiple(msgs_bytes)
+                    bytes_sent = sum(len(msg_bytes) for msg_bytes in msgs_bytes)
+                    self.messages_sent += len(msgs_bytes)
+                    self.sends += 1
+                    self.bytes_sent += bytes_sent
+                    connection_writer_counters['messages'] += len(msgs_bytes)
+                    connection_writer_counters['sends'] += 1
+                    connection_writer_counters['bytes'] += bytes_sent
+                except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
                     # Ignore a closed connection here. The reader will notice
                     # it and send us the DisconnectedMessage to tell us that
                     # we can close the socket and terminate
                     pass
-            else:
+
+            if isinstance(msg, PeerDisconnectedMessage):
                 self.sock.close()
+                self.logger.info('%s(%s): writer sent %d messages in %d sends (%d bytes)' %
+                                 (self.task_name, self.task_id, self.messages_sent, self.sends, self.bytes_sent))
                 if msg.exception:
                     raise msg.exception
                 else:
@@ -118,6 +157,28 @@ class ConnectionWriter:
 
         self.logger.info('%s(%s): writer exiting gracefully' % (self.task_name, self.task_id))
 
+    def _encode_queued_messages(self, msgs_bytes):
+        """
+        Encode messages that are waiting in the queue and add them to msgs_bytes,
+        until the queue is empty or the byte budget is used up. Returns the
+        PeerDisconnectedMessage if one was taken from the queue, or None.
+        """
+        if self.coalesce_delay:
+            gevent.sleep(self.coalesce_delay)
+
+        size = sum(len(msg_bytes) for msg_bytes in msgs_bytes)
+        while size < self.coalesce_max_bytes:
+            try:
+                msg = self.outgoing_queue.get_nowait()
+            except gevent.queue.Empty:
+                break
+            if isinstance(msg, PeerDisconnectedMessage):
+                return msg
+            msg_bytes = self.encode(msg)
+            msgs_bytes.append(msg_bytes)
+            size += len(msg_bytes)
+        return None
+
     def encode(self, msg):
         """ Encode msg into a series of bytes """
         raise NotImplementedError('encode must be implemented in a subclass of ConnectionWriter')
@@ -126,17 +187,140 @@ class ConnectionWriter:
         """ Send the bytes that make up a message out over the socket """
         raise NotImplementedError('send must be implemented in a subclass of ConnectionWriter')
 
+    def send_multiple(self, msgs_bytes):
+        """ Send several encoded messages, preferably with a single write to the socket """
+        for msg_bytes in msgs_bytes:
+            self.send(msg_bytes)
+
 
 class TcpMessageConnectionWriter(ConnectionWriter):
-    def __init__(self, sock, max_message_size = 0xFFFF, dump_queue = None):
-        super().__init__(sock)
+    def __init__(self, sock, max_message_size = 0xFFFF, dump_queue = None,
+                 coalesce = False, coalesce_max_bytes = 0x10000, coalesce_delay = 0):
+        super().__init__(sock, coalesce=coalesce, coalesce_max_bytes=coalesce_max_bytes,
+                         coalesce_delay=coalesce_delay)
         self.tcp_writer = TcpMessageWriter(sock, max_message_size = max_message_size, dump_queue = dump_queue)
 
     def send(self, msg_bytes):
         return self.tcp_writer.send(msg_bytes)
 
+    def send_multiple(self, msgs_bytes):
+        return self.tcp_writer.send_multiple(msgs_bytes)
+
+
+# Totals of the counters of all PeerQueues
+peer_queue_counters = Counter()
+
+
+class PeerQueue(gevent.queue.Queue):
+    """
+    Outgoing queue of a peer, with a policy for what to do when it is full:
+
+    - POLICY_BLOCK makes put wait until there is room again
+    - POLICY_DROP_OLDEST drops the oldest queued message that the peer
+      considers droppable, and disconnects the peer if there is none
+    - POLICY_DISCONNECT disconnects the peer
+    - POLICY_SPILL lets the queue grow beyond its size until the estimated
+      size of all queued messages exceeds spill_max_bytes, and then
+      disconnects the peer
+
+    Disconnecting a peer puts a PeerDisconnectedMessage in the queue, even
+    though it is full, and drops any further messages. Only POLICY_BLOCK
+    can make the sender wait, so one slow peer can't hold up everyone else.
+
+    A full queue usually means that the writer is stuck sending to a peer
+    that doesn't read, so it would never get to that message. So when a
+    disconnect has to go into a full queue, the socket is shut down as
+    well. That makes the writer's send fail and the reader see the end of
+    the connection, and what was still queued is dropped.
+    """
+    POLICY_BLOCK = 'block'
+    POLICY_DROP_OLDEST = 'drop_oldest'
+    POLICY_DISCONNECT = 'disconnect'
+    POLICY_SPILL = 'spill'
+
+    def __init__(self, peer, maxsize=100, policy=POLICY_BLOCK, spill_max_bytes=0x100000, sock=None):
+        super().__init__(maxsize=maxsize)
+        self.logger = logging.getLogger(__name__)
+        self.peer = peer
+        self.sock = sock
+        self.policy = policy
+        self.spill_max_bytes = spill_max_bytes
+        self.queued_bytes = 0
+        self.disconnected = False
+        self.counters = Counter()
+
+    def _count(self, counter):
+        self.counters[counter] += 1
+        peer_queue_counters[counter] += 1
+
+    def _put(self, item):
+        self.queued_bytes += self.peer.estimate_message_size(item)
+        super()._put(item)
+
+    def _get(self):
+        item = super()._get()
+        self.queued_bytes -= self.peer.estimate_message_size(item)
+        return item
+
+    def put(self, item, block=True, timeout=None):
+        if self.disconnected:
+            self._count('dropped_after_disconnect')
+        elif isinstance(item, PeerDisconnectedMessage):
+            self._put_disconnect(item)
+        elif self.policy == self.POLICY_BLOCK or not self.full():
+            super().put(item, block, timeout)
+        elif self.policy == self.POLICY_DROP_OLDEST:
+            self._drop_oldest(item)
+        elif self.policy == self.POLICY_SPILL and \
+                self.queued_bytes + self.peer.estimate_message_size(item) <= self.spill_max_bytes:
+            self._put(item)
+            self._count('spilled')
+        else:
+            self._disconnect_on_overflow()
+
+    def _put_disconnect(self, item):
+        self.disconnected = True
+        if self.full():
+            # Nobody can be waiting in get while the queue is full, so it is
+            # enough to append the message without waking anyone up
+            self._put(item)
+            self._shut_down_socket()
+        else:
+            super().put(item)
+
+    def _shut_down_socket(self):
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                # Already closed by the other side
+                pass
+
+    def _drop_oldest(self, item):
+        for idx, queued_item in enumerate(self.queue):
+            if self.peer.is_droppable_message(queued_item):
+                del self.queue[idx]
+                self.queued_bytes -= self.peer.estimate_message_size(queued_item)
+                self._count('dropped')
+                super().put(item)
+                return
+
+        if self.peer.is_droppable_message(item):
+            self._count('dropped')
+        else:
+            self._disconnect_on_overflow()
+
+    def _disconnect_on_overflow(self):
+        self.logger.warning('%s(%s): outgoing queue overflowed (%s policy); disconnecting' %
+                            (self.peer.task_name, self.peer.task_id, self.policy))
+        self._count('overflow_disconnects')
+        self._put_disconnect(PeerDisconnectedMessage(self.peer))
+
 
 class Peer:
+    outgoing_queue_policy = PeerQueue.POLICY_BLOCK
+    estimated_message_size = 512
+
     def __init__(self):
         self.task_name = None
         self.task_id = None
@@ -148,6 +332,14 @@ class Peer:
     def disconnect(self, exception=None):
         self.outgoing_queue.put(PeerDisconnectedMessage(self, exception))
 
+    def is_droppable_message(self, msg):
+        """ Whether msg may be left out when the outgoing queue overflows """
+        return False
+
+    def estimate_message_size(self, msg):
+        """ Rough size of msg once it is encoded, used for POLICY_SPILL """
+        return self.estimated_message_size
+
 
 class ConnectionHandler:
     def __init__(self, task_name, address, port, incoming_queue):
@@ -185,7 +377,7 @@ class ConnectionHandler:
                             'and the type is the only way to distinguish between messages from '
                             'different ConnectionHandlers.')
 
-        outgoing_queue = gevent.queue.Queue(maxsize=100)
+        outgoing_queue = PeerQueue(peer, maxsize=100, policy=peer.outgoing_queue_policy, sock=sock)
 
         peer.task_id = task_id
         peer.task_name = self.task_name
@@ -20,7 +20,12 @@
 
 from common.game_items import GamePurchase, GameClass, UnlockableGameClass, \
     UnlockableClassSpecificItem, UnlockableWeapon, UnlockableVoice
+from common.utils import IdentityCache
 from typing import Set, Iterable
+import copy
+import io
+import itertools
+import re
 import struct
 from ipaddress import IPv4Address
 
@@ -186,29 +191,159 @@ def hexparse(hexstring):
     return bytes([int('0x' + hexbyte, base=16) for hexbyte in hexstring.split()])
 
 
+_original_capture = None
+
+
 def _originalbytes(start, end):
-    with open('resources/tribescapture.bin.stripped', 'rb') as f:
-        f.seek(start)
-        return f.read(end - start)
+    # The capture is read only once and fragments are handed out as views
+    # on it, so replaying original bytes never touches the file system again
+    global _original_capture
+    if _original_capture is None:
+        with open('resources/tribescapture.bin.stripped', 'rb') as f:
+            _original_capture = memoryview(f.read())
+    return _original_capture[start:end]
 
 
 def findbytype(arr, requestedtype):
-    for item in arr:
+    if type(arr) is fieldlist:
+        idx = arr.index_of_type(requestedtype)
+        return None if idx is None else _unshare(arr, idx)
+    for idx, item in enumerate(arr):
         if type(item) == requestedtype:
-            return item
+            return _unshare(arr, idx)
     return None
 
 
+# ------------------------------------------------------------
+# shared instances
+# ------------------------------------------------------------
+
+_shared_instances = {}
+
+
+def _unshare(arr, idx):
+    """ Replace a shared field in arr by a private copy, so that the caller can modify it """
+    item = arr[idx]
+    if _shared_instances.get(type(item)) is item:
+        item = copy.copy(item)
+        arr[idx] = item
+    return item
+
+
+# ------------------------------------------------------------
+# field lists
+# ------------------------------------------------------------
+
+def _field_type(item):
+    return item.cls if type(item) is rawfield else type(item)
+
+
+def _invalidates_index(method):
+    def invalidate_and_call(self, *args, **kwargs):
+        self._first_index = None
+        return method(self, *args, **kwargs)
+    return invalidate_and_call
+
+
+class fieldlist(list):
+    """
+    The content of an enumblockarray. This is a list that also keeps track
+    of the index of the first field of every type, so that findbytype does
+    not have to search for it. Appending keeps that index up to date, other
+    modifications make it be rebuilt on the next lookup.
+    """
+    __slots__ = ('_first_index',)
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._first_index = None
+
+    def __copy__(self):
+        return fieldlist(self)
+
+    def index_of_type(self, requestedtype):
+        if self._first_index is None:
+            first_index = {}
+            for idx, item in enumerate(self):
+                first_index.setdefault(_field_type(item), idx)
+            self._first_index = first_index
+        return self._first_index.get(requestedtype)
+
+    def append(self, item):
+        if self._first_index is not None:
+            self._first_index.setdefault(_field_type(item), len(self))
+        super().append(item)
+
+    def extend(self, items):
+        if self._first_index is not None:
+            items = list(items)
+            for idx, item in enumerate(items, start=len(self)):
+                self._first_index.setdefault(_field_type(item), idx)
+        super().extend(items)
+
+    def __setitem__(self, key, value):
+        # Replacing a field by one of the same type is what findbytype itself
+        # does for shared and undecoded fields, so that keeps the index valid
+        if self._first_index is not None and \
+                not (isinstance(key, int) and _field_type(self[key]) is _field_type(value)):
+            self._first_index = None
+        super().__setitem__(key, value)
+
+    __delitem__ = _invalidates_index(list.__delitem__)
+    __iadd__ = _invalidates_index(list.__iadd__)
+    __imul__ = _invalidates_index(list.__imul__)
+    insert = _invalidates_index(list.insert)
+    pop = _invalidates_index(list.pop)
+    remove = _invalidates_index(list.remove)
+    clear = _invalidates_index(list.clear)
+    sort = _invalidates_index(list.sort)
+    reverse = _invalidates_index(list.reverse)
+
+
+class enumfieldmeta(type):
+    """ Gives every field class empty __slots__ unless it declares its own, so instances have no __dict__ """
+    def __new__(mcs, name, bases, namespace):
+        namespace.setdefault('__slots__', ())
+        return super().__new__(mcs, name, bases, namespace)
+
+
+class sharable(metaclass=enumfieldmeta):
+    """
+    Base for fields with a simple value, whose default-valued instances
+    can be shared between messages instead of being allocated for each one.
+    A shared instance must never be modified. Setting its value raises a
+    ValueError, but nothing stops assigning to its attributes directly, so
+    only use shared() for fields that are never changed after the message
+    is built. findbytype() hands out a private copy of a shared field, so
+    fields found that way can be modified as usual.
+    """
+
+    @classmethod
+    def shared(cls):
+        instance = _shared_instances.get(cls)
+        if instance is None:
+            instance = cls()
+            _shared_instances[cls] = instance
+        return instance
+
+    def _check_writable(self):
+        if _shared_instances.get(type(self)) is self:
+            raise ValueError('Cannot modify the shared instance of %s; create a new one instead' % type(self).__name__)
+
+
 # ------------------------------------------------------------
 # base types
 # ------------------------------------------------------------
 
-class onebyte():
+class onebyte(sharable):
+    __slots__ = ('ident', 'value')
+
     def __init__(self, ident, value):
         self.ident = ident
         self.value = value
 
     def set(self, value):
+        self._check_writable()
         self.value = value
         return self
 
@@ -223,7 +358,9 @@ class onebyte():
         return self
 
 
-class twobytes():
+class twobytes(sharable):
+    __slots__ = ('ident', 'value')
+
     def __init__(self, ident, value):
         self.ident = ident
         self.value = value
@@ -239,13 +376,16 @@ class twobytes():
         return self
 
 
-class fourbytes():
+class fourbytes(sharable):
+    __slots__ = ('ident', 'value')
+
     def __init__(self, ident, value):
         self.ident = ident
         self.value = value
 
     def set(self, value):
         assert 0 <= value <= 0xFFFFFFFF
+        self._check_writable()
         self.value = value
         return self
 
@@ -260,13 +400,16 @@ class fourbytes():
         return self
 
 
-class nbytes():
+class nbytes(sharable):
+    __slots__ = ('ident', 'value')
+
     def __init__(self, ident, valuebytes):
         self.ident = ident
         self.value = valuebytes
 
     def set(self, value):
         assert len(value) == len(self.value)
+        self._check_writable()
         self.value = value
         return self
 
@@ -281,7 +424,9 @@ class nbytes():
         return self
 
 
-class stringenum():
+class stringenum(sharable):
+    __slots__ = ('ident', 'value')
+
     def __init__(self, ident, value):
         self.ident = ident
         self.value = value
@@ -289,6 +434,7 @@ class stringenum():
     def set(self, value):
         if not isinstance(value, str):
             raise ValueError('Cannot set the value of a stringenum to %s' % type(value).__name__)
+        self._check_writable()
         self.value = value
         return self
 
@@ -303,7 +449,9 @@ class stringenum():
         return self
 
 
-class arrayofenumblockarrays():
+class arrayofenumblockarrays(metaclass=enumfieldmeta):
+    __slots__ = ('ident', 'arrays', 'original_bytes')
+
     def __init__(self, ident):
         self.ident = ident
         self.arrays = []
@@ -325,61 +473,127 @@ class arrayofenumblockarrays():
         else:
             stream.write(struct.pack('<HH', self.ident, len(self.arrays)))
             for arr in self.arrays:
-                stream.write(struct.pack('<H', len(arr)))
-                for enumfield in arr:
-                    enumfield.write(stream)
+                if type(arr) is encodedfragment:
+                    # A row that was encoded before, including its length
+                    arr.write(stream)
+                else:
+                    stream.write(struct.pack('<H', len(arr)))
+                    _write_fields(stream, arr)
 
     def read(self, stream):
         ident, length1 = struct.unpack('<HH', stream.read(4))
         if ident != self.ident:
             raise ParseError('self.ident(%02X) did not match parsed ident value (%02X)' % (self.ident, ident))
         self.arrays = []
+        layout = None
         for _ in range(length1):
-            innerarray = []
             length2 = struct.unpack('<H', stream.read(2))[0]
-            for _ in range(length2):
-                enumid = struct.unpack('<H', stream.peek(2))[0]
-                classname = ('m%04X' % enumid).lower()
-                element = globals()[classname]().read(stream)
-                innerarray.append(element)
+
+            # Rows of an array usually all have the same layout, so try to
+            # decode the row in one go with the layout of the previous one
+            innerarray = None
+            if layout is not None and len(layout.types) == length2:
+                innerarray = layout.read(stream)
+
+            if innerarray is None:
+                innerarray = []
+                for _ in range(length2):
+                    enumid = struct.unpack('<H', stream.peek(2))[0]
+                    element = _enumfield_classes[enumid]().read(stream)
+                    innerarray.append(element)
+                layout = _fixed_layout(innerarray)
+
             self.arrays.append(innerarray)
         return self
 
 
-class enumblockarray():
+class enumblockarray(metaclass=enumfieldmeta):
+    __slots__ = ('ident', '_content')
+
     def __init__(self, ident):
         self.ident = ident
         self.content = []
 
+    @property
+    def content(self):
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._content = content if type(content) is fieldlist else fieldlist(content)
+
     def findbytype(self, requestedtype):
-        for item in self.content:
-            if type(item) == requestedtype:
-                return item
-        return None
+        return findbytype(self._content, requestedtype)
 
     def set(self, content):
         self.content = content
         return self
 
     def write(self, stream):
-        stream.write(struct.pack('<HH', self.ident, len(self.content)))
-        for el in self.content:
-            el.write(stream)
+        stream.write(struct.pack('<HH', self.ident, len(self._content)))
+        _write_fields(stream, self._content)
 
     def read(self, stream):
         ident, length = struct.unpack('<HH', stream.read(4))
         if ident != self.ident:
             raise ParseError('self.ident(%02X) did not match parsed ident value (%02X)' % (self.ident, ident))
-        self.content = []
+        content = fieldlist()
         for i in range(length):
             enumid = struct.unpack('<H', stream.peek(2))[0]
-            classname = ('m%04X' % enumid).lower()
-            element = globals()[classname]().read(stream)
-            self.content.append(element)
+            element = _enumfield_classes[enumid]().read(stream)
+            content.append(element)
+        self._content = content
         return self
 
 
-class variablelengthbytes():
+class lazyenumblockarray(enumblockarray):
+    """
+    An enumblockarray that postpones decoding its fields until they are
+    needed. Reading it only stores the encoded bytes of every field. A field
+    is decoded when it is looked up with findbytype, and all of them are
+    decoded when content is accessed. Fields that were never decoded are
+    written out as the bytes they were read from.
+    """
+
+    def _decoded_content(self):
+        content = self._content
+        for idx, item in enumerate(content):
+            if type(item) is rawfield:
+                content[idx] = item.decode()
+        return content
+
+    content = property(_decoded_content, enumblockarray.content.fset)
+
+    def findbytype(self, requestedtype):
+        idx = self._content.index_of_type(requestedtype)
+        if idx is None:
+            return None
+        item = self._content[idx]
+        if type(item) is rawfield:
+            item = item.decode()
+            self._content[idx] = item
+            return item
+        return _unshare(self._content, idx)
+
+    def write(self, stream):
+        stream.write(struct.pack('<HH', self.ident, len(self._content)))
+        if any(type(item) is rawfield for item in self._content):
+            for item in self._content:
+                item.write(stream)
+        else:
+            _write_fields(stream, self._content)
+
+    def read(self, stream):
+        ident, length = struct.unpack('<HH', stream.read(4))
+        if ident != self.ident:
+            raise ParseError('self.ident(%02X) did not match parsed ident value (%02X)' % (self.ident, ident))
+        self._content = fieldlist(_read_lazily(stream) for _ in range(length))
+        return self
+
+
+class variablelengthbytes(metaclass=enumfieldmeta):
+    __slots__ = ('ident', 'content')
+
     def __init__(self, ident, content):
         self.ident = ident
         self.content = content
@@ -453,6 +667,7 @@ class m0442(onebyte):
         super().__init__(0x0442, 0x01)
 
     def set_success(self, success):
+        self._check_writable()
         self.value = 1 if success else 0
         return self
 
@@ -1492,6 +1707,7 @@ class m0246(nbytes):
         super().__init__(0x0246, hexparse('00 00 00 00 00 00 00 00'))
 
     def set(self, ip: IPv4Address, port):
+        self._check_writable()
         self.value = struct.pack('>BBH', 0x02, 0x00, port) + ip.packed
         return self
 
@@ -1501,6 +1717,7 @@ class m024f(nbytes):
         super().__init__(0x024f, hexparse('00 00 00 00 00 00 00 00'))
 
     def set(self, ip: IPv4Address, port: int):
+        self._check_writable()
         self.value = struct.pack('>BBH', 0x02, 0x00, port) + ip.packed
         return self
 
@@ -1583,8 +1800,7 @@ class m00aa(stringenum):
         super().__init__(0x00aa, 'y')
 
     def set_custom(self, custom):
-        self.set('y' if custom else 'n')
-        return self
+        return self.set('y' if custom else 'n')
 
 class m00ab(stringenum):
     def __init__(self):
@@ -1735,53 +1951,58 @@ class m00e9(arrayofenumblockarrays):
         super().__init__(0x00e9)
 
     def setservers(self, servers, player_address):
-        self.arrays = []
-        for server in servers:
-            if not server.joinable:
-                continue
+        self.arrays = [m00e9.server_row(server, player_address) for server in servers if server.joinable]
+        return self
 
-            self.arrays.append([
-                m0385(),
-                m06ee(),
-                m02c7().set(server.server_id),
-                m0008(),
-                m02ff(),
-                m02ed(),
-                m02d8(),
-                m02ec(),
-                m02d7(),
-                m02af(),
-                m0013(),
-                m00aa(),
-                m01a6(),
-                m06f1(),
-                m0703(),
-                m0343().set(len(server.players)),
-                m0344(),
-                m0259(),
-                m03fd(),
-                m02b3(),
-                m0448().set(server.region),
-                m02d6(),
-                m06f5(),
-                m0299(),
-                m0298(),
-                m06bf(),
-                m069c().set(0x01 if server.password_hash is not None else 0x00),
-                m069b().set(0x01 if server.password_hash is not None else 0x00),
-                m0300().set(server.game_setting_mode.upper() + ' | ' + server.description),
-                m01a4().set(server.motd),
-                m02b2().set(server.map_id),
-                m02b5(),
-                m0347().set(0x00000018),
-                m02f4().set(server.get_time_remaining()),
-                m0035().set(server.be_score),
-                m0197().set(server.ds_score),
-                m0246().set(server.address_pair.get_address_seen_from(player_address), server.pingport)
-                                                # The value doesn't matter, the client uses the address in a0035
-            ])
+    def setserverrows(self, rows):
+        """ Sets the servers from rows that were encoded before, see serverlistrow """
+        self.original_bytes = None
+        self.arrays = list(rows)
         return self
 
+    @staticmethod
+    def server_row(server, player_address):
+        return [
+            m0385.shared(),
+            m06ee.shared(),
+            m02c7().set(server.server_id),
+            m0008.shared(),
+            m02ff.shared(),
+            m02ed.shared(),
+            m02d8.shared(),
+            m02ec.shared(),
+            m02d7.shared(),
+            m02af.shared(),
+            m0013.shared(),
+            m00aa.shared(),
+            m01a6.shared(),
+            m06f1.shared(),
+            m0703.shared(),
+            m0343().set(len(server.players)),
+            m0344.shared(),
+            m0259.shared(),
+            m03fd.shared(),
+            m02b3.shared(),
+            m0448().set(server.region),
+            m02d6.shared(),
+            m06f5.shared(),
+            m0299.shared(),
+            m0298.shared(),
+            m06bf.shared(),
+            m069c().set(0x01 if server.password_hash is not None else 0x00),
+            m069b().set(0x01 if server.password_hash is not None else 0x00),
+            m0300().set(server.game_setting_mode.upper() + ' | ' + server.description),
+            m01a4().set(server.motd),
+            m02b2().set(server.map_id),
+            m02b5.shared(),
+            m0347().set(0x00000018),
+            m02f4().set(server.get_time_remaining()),
+            m0035().set(server.be_score),
+            m0197().set(server.ds_score),
+            m0246().set(server.address_pair.get_address_seen_from(player_address), server.pingport)
+                                            # The value doesn't matter, the client uses the address in a0035
+        ]
+
     def setplayers(self, players):
         assert len(self.arrays) == 1, 'Can only set players for an m00e9 message that contains a single server'
         self.arrays[0].append(
@@ -1829,28 +2050,28 @@ class m0122(arrayofenumblockarrays):
                 m057f().set(0x27a1),
                 # in capture, either 0 or 0x27a1, not clear on pattern; either seems_to work at least for weapon menus?
                 m026d().set(item.item_id),
-                m04d5(),
+                m04d5.shared(),
                 m0273().set(item.item_kind_id),
-                m0272(),
+                m0272.shared(),
                 m0380().set(0x0001),
-                m05ee(),
+                m05ee.shared(),
                 m026f().set(item.name),
                 m02ff().set(idx + 1),
                 # Needs to be unique between items seemingly; in capture there seems to be a mapping between the value here and other menu sections, unknown if important
-                m01a3().set(idx) if isinstance(item, UnlockableVoice) else m01a3(),
+                m01a3().set(idx) if isinstance(item, UnlockableVoice) else m01a3.shared(),
                 # Voices have this = m02ff's value - 1?
-                m03f1(),
-                m03a4(),
-                m0253(),
-                m037f().set(item.category) if isinstance(item, UnlockableWeapon) else m037f(),
-                m04bb(),
-                m0577(),
+                m03f1.shared(),
+                m03a4.shared(),
+                m0253.shared(),
+                m037f().set(item.category) if isinstance(item, UnlockableWeapon) else m037f.shared(),
+                m04bb.shared(),
+                m0577.shared(),
                 m0398().set(item.game_class.class_id) if isinstance(item, UnlockableClassSpecificItem) or isinstance(
-                    item, UnlockableGameClass) else m0398(),
+                    item, UnlockableGameClass) else m0398.shared(),
                 # Below is used to map weapon name <-> item id; also for weapon upgrades to tie an upgrade to an item id
-                m04fa().set(item.item_id) if include_id_mapping else m04fa(),
-                m0602(),
-                m03fd(),
+                m04fa().set(item.item_id) if include_id_mapping else m04fa.shared(),
+                m0602.shared(),
+                m03fd.shared(),
                 # Sometimes filled in capture, may relate to pricing; doesn't seem to cause issues if not filled
                 # Price - currently this only handles pricing for items (in gold/xp)
                 # Field is also used to handle pricing for gold etc.
@@ -1897,17 +2118,17 @@ class m0132(arrayofenumblockarrays):
             self.arrays.append([
                 m0348().set(player.unique_id),
                 m034a().set(player.display_name),
-                m042a(),
-                m0558(),
-                m0363(),
-                m0615(),
+                m042a.shared(),
+                m0558.shared(),
+                m0363.shared(),
+                m0615.shared(),
                 m0452().set(player_team_to_datatype_team[player.team]),
-                m0225(),
-                m0296(),
-                m06ee(),
-                m042e(),
-                m042f(),
-                m03f5()
+                m0225.shared(),
+                m0296.shared(),
+                m06ee.shared(),
+                m042e.shared(),
+                m042f.shared(),
+                m03f5.shared()
             ])
         return self
 
@@ -2795,7 +3016,16 @@ class a003a(enumblockarray):
         ]
 
 
+# Login reply templates per class menu data object. There is one such object
+# per game setting mode, built when common.game_items is imported, so the
+# bound is only there in case menu data ever gets built at runtime.
+_a003d_templates = IdentityCache(lambda class_menu_data: enumblockarraytemplate(
+    a003d().set_menu_data(class_menu_data), a003d.player_field_types), maxsize=8)
+
+
 class a003d(enumblockarray):
+    player_field_types = (m0348, m034a, m06de, m05dc, m0662)
+
     def __init__(self):
         super().__init__(0x003d)
 
@@ -2823,23 +3053,23 @@ class a003d(enumblockarray):
             m0363().set(game_class.class_id),
             m00a2().set(str(game_class.secondary_id)),
             m0138(),
-            m02fe(),
-            m02b2(),
-            m021f(),
-            m057d(),
-            m057e(),
+            m02fe.shared(),
+            m02b2.shared(),
+            m021f.shared(),
+            m057d.shared(),
+            m057e.shared(),
             m057f().set(0x27a4),
-            m05e2(),
-            m0684(),
-            m05dc(),
-            m04cb(),
-            m00d4(),
-            m025c(),
-            m025d(),
-            m025e(),
+            m05e2.shared(),
+            m0684.shared(),
+            m05dc.shared(),
+            m04cb.shared(),
+            m00d4.shared(),
+            m025c.shared(),
+            m025d.shared(),
+            m025e.shared(),
             m025f().set(0xFFFFF448),
-            m0596(),
-            m0597()
+            m0596.shared(),
+            m0597.shared()
         ]
             for idx, (name, game_class)
             in enumerate(class_menu_data.classes.items())]
@@ -2886,11 +3116,13 @@ class a003d(enumblockarray):
         return self
 
     def set_player(self, player):
-        self.findbytype(m0348).set(player.unique_id)
-        self.findbytype(m034a).set(player.display_name)
-        self.findbytype(m06de).set(player.player_settings.clan_tag)
-        self.findbytype(m05dc).set(player.player_settings.progression.rank_xp)
+        player_fields = {type(field): field for field in a003d.player_fields(player)}
+        self.content = [player_fields.get(type(field), field) for field in self.content]
+        return self
 
+    @staticmethod
+    def player_fields(player):
+        """ The fields of the login reply that differ per player """
         loadout_arrays = []
         loadout_overall_idx = 0
         for class_id, class_loadout in player.get_unmodded_loadouts().get_data().items():
@@ -2934,9 +3166,18 @@ class a003d(enumblockarray):
                 ])
                 loadout_overall_idx += 1
 
-        self.findbytype(m0662).set(loadout_arrays)
+        return [
+            m0348().set(player.unique_id),
+            m034a().set(player.display_name),
+            m06de().set(player.player_settings.clan_tag),
+            m05dc().set(player.player_settings.progression.rank_xp),
+            m0662().set(loadout_arrays)
+        ]
 
-        return self
+    @staticmethod
+    def template(class_menu_data):
+        """ The login reply for class_menu_data, encoded once and ready to be filled with player_fields """
+        return _a003d_templates.get(class_menu_data)
 
 
 class a0041(enumblockarray):
@@ -2962,7 +3203,7 @@ class a006f(enumblockarray):
         ]
 
 
-class a0070(enumblockarray):
+class a0070(lazyenumblockarray):
     def __init__(self):
         super().__init__(0x0070)
         self.content = [
@@ -3086,6 +3327,10 @@ class a00d5(enumblockarray):
         self.findbytype(m00e9).setservers(servers, player_address)
         return self
 
+    def setserverrows(self, rows):
+        self.findbytype(m00e9).setserverrows(rows)
+        return self
+
 
 class a00ec(enumblockarray):
     def __init__(self):
@@ -3233,7 +3478,7 @@ class a01c6(enumblockarray):
         super().__init__(0x01c6)
 
 
-class a01c8(enumblockarray):
+class a01c8(lazyenumblockarray):
     def __init__(self):
         super().__init__(0x01c8)
 
@@ -3266,6 +3511,8 @@ class m0620(passwordlike):
 
 
 class originalfragment():
+    __slots__ = ('fromoffset', 'tooffset')
+
     def __init__(self, fromoffset, tooffset):
         self.fromoffset = fromoffset
         self.tooffset = tooffset
@@ -3274,12 +3521,371 @@ class originalfragment():
         stream.write(_originalbytes(self.fromoffset, self.tooffset))
 
 
-def construct_top_level_enumfield(stream):
-    ident = struct.unpack('<H', stream.peek(2))[0]
-    classname = ('a%04X' % ident).lower()
+class encodedfragment():
+    """ Bytes that were already encoded and are written out as they are """
+    __slots__ = ('ident', 'data')
+
+    def __init__(self, ident, data):
+        self.ident = ident
+        self.data = data
+
+    @classmethod
+    def from_message(cls, msg):
+        """ Encodes msg once, so that it can be sent any number of times """
+        stream = io.BytesIO()
+        msg.write(stream)
+        return cls(msg.ident, stream.getvalue())
+
+    def write(self, stream):
+        stream.write(self.data)
+
+
+# ------------------------------------------------------------
+# fixed layouts
+# ------------------------------------------------------------
+
+class fixedlayout():
+    """
+    Encoder/decoder for a sequence of fields of known types. Every run of
+    consecutive fixed-width fields is packed or unpacked with a single
+    precompiled struct.Struct, while variable-length fields in between
+    are written by their own write method.
+    """
+    __slots__ = ('types', 'runs', 'struct')
+
+    def __init__(self, fields):
+        self.types = tuple(type(field) for field in fields)
+        # Each run is (start, end, struct, idents) for fixed-width fields
+        # and (index, index + 1, None, None) for a variable-length field
+        self.runs = []
+        run_start = None
+        run_format = ''
+        for idx, field in enumerate(fields):
+            value_format = _fixed_value_format(field)
+            if value_format is not None:
+                if run_start is None:
+                    run_start = idx
+                    run_format = '<'
+                run_format += 'H' + value_format
+            else:
+                if run_start is not None:
+                    self._add_fixed_run(fields, run_start, idx, run_format)
+                    run_start = None
+                self.runs.append((idx, idx + 1, None, None))
+        if run_start is not None:
+            self._add_fixed_run(fields, run_start, len(fields), run_format)
+
+        # Only a layout that consists of a single fixed-width run can be decoded
+        if len(self.runs) == 1 and self.runs[0][2] is not None:
+            self.struct = self.runs[0][2]
+        else:
+            self.struct = None
+
+    def _add_fixed_run(self, fields, start, end, run_format):
+        idents = tuple(field.ident for field in fields[start:end])
+        self.runs.append((start, end, struct.Struct(run_format), idents))
+
+    def write(self, stream, fields):
+        for start, end, packer, idents in self.runs:
+            if packer is None:
+                fields[start].write(stream)
+            else:
+                values = [field.value for field in fields[start:end]]
+                stream.write(packer.pack(*itertools.chain.from_iterable(zip(idents, values))))
+
+    def read(self, stream):
+        """
+        Decode fields with this layout from the stream, or return None
+        without consuming anything if the next bytes have a different layout.
+        This only reads bytes that the stream has already buffered, so that
+        a mismatch can never cause it to wait for data that will not come.
+        """
+        if self.struct is None or \
+           not hasattr(stream, 'available') or \
+           stream.available() < self.struct.size:
+            return None
+
+        values = self.struct.unpack(stream.peek(self.struct.size))
+        if values[0::2] != self.runs[0][3]:
+            return None
+
+        stream.read(self.struct.size)
+        fields = []
+        for field_type, value in zip(self.types, values[1::2]):
+            field = field_type()
+            field.value = value
+            fields.append(field)
+        return fields
+
+
+def _fixed_value_format(field):
+    """ Return the struct format of the value of a fixed-width field or None for any other field """
+    field_type = type(field)
+    if field_type.write is onebyte.write:
+        return 'B'
+    elif field_type.write is twobytes.write:
+        return 'H'
+    elif field_type.write is fourbytes.write:
+        return 'L'
+    elif field_type.write is nbytes.write:
+        return '%ds' % len(field.value)
+    else:
+        return None
+
+
+_fixed_layouts = {}
+_MAX_FIXED_LAYOUTS = 1024
+
+
+def _fixed_layout(fields):
+    types = tuple(map(type, fields))
+    layout = _fixed_layouts.get(types)
+    if layout is None:
+        # Decoded client data determines some of the layouts, so don't let the cache grow without bounds
+        if len(_fixed_layouts) >= _MAX_FIXED_LAYOUTS:
+            _fixed_layouts.clear()
+        layout = fixedlayout(fields)
+        _fixed_layouts[types] = layout
+    return layout
+
+
+def _write_fields(stream, fields):
+    _fixed_layout(fields).write(stream, fields)
 
-    if classname not in globals():
-        classname = ('m%04X' % ident).lower()
 
-    obj = globals()[classname]().read(stream)
+# ------------------------------------------------------------
+# lazy decoding
+# ------------------------------------------------------------
+
+class bytesreader():
+    """ Stream for decoding fields from bytes that were read before """
+    __slots__ = ('data', 'offset')
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read(self, length):
+        requestedbytes = self.data[self.offset:self.offset + length]
+        self.offset += length
+        return requestedbytes
+
+    def peek(self, length):
+        return self.data[self.offset:self.offset + length]
+
+    def available(self):
+        return len(self.data) - self.offset
+
+
+class rawfield():
+    """ The encoded bytes of a field of type cls that has not been decoded yet """
+    __slots__ = ('cls', 'data')
+
+    def __init__(self, cls, data):
+        self.cls = cls
+        self.data = data
+
+    def decode(self):
+        return self.cls().read(bytesreader(self.data))
+
+    def write(self, stream):
+        stream.write(self.data)
+
+
+def _raw_fixed_reader(length):
+    def read_raw(stream, chunks):
+        chunks.append(stream.read(length))
+    return read_raw
+
+
+def _read_raw_stringenum(stream, chunks):
+    header = stream.read(4)
+    chunks.append(header)
+    chunks.append(stream.read(struct.unpack('<HH', header)[1]))
+
+
+def _read_raw_variablelengthbytes(stream, chunks):
+    header = stream.read(6)
+    chunks.append(header)
+    chunks.append(stream.read(struct.unpack('<HL', header)[1]))
+
+
+def _read_raw_passwordlike(stream, chunks):
+    header = stream.read(4)
+    chunks.append(header)
+    chunks.append(stream.read((struct.unpack('<HH', header)[1] & 0x7FFF) * 2))
+
+
+def _read_raw_fields(stream, chunks, count):
+    for _ in range(count):
+        enumid = struct.unpack('<H', stream.peek(2))[0]
+        _raw_reader(_enumfield_classes[enumid])(stream, chunks)
+
+
+def _read_raw_enumblockarray(stream, chunks):
+    header = stream.read(4)
+    chunks.append(header)
+    _read_raw_fields(stream, chunks, struct.unpack('<HH', header)[1])
+
+
+def _read_raw_arrayofenumblockarrays(stream, chunks):
+    header = stream.read(4)
+    chunks.append(header)
+    for _ in range(struct.unpack('<HH', header)[1]):
+        length = stream.read(2)
+        chunks.append(length)
+        _read_raw_fields(stream, chunks, struct.unpack('<H', length)[0])
+
+
+_raw_readers_by_base_type = {
+    onebyte: _raw_fixed_reader(3),
+    twobytes: _raw_fixed_reader(4),
+    fourbytes: _raw_fixed_reader(6),
+    stringenum: _read_raw_stringenum,
+    variablelengthbytes: _read_raw_variablelengthbytes,
+    passwordlike: _read_raw_passwordlike,
+    enumblockarray: _read_raw_enumblockarray,
+    lazyenumblockarray: _read_raw_enumblockarray,
+    arrayofenumblockarrays: _read_raw_arrayofenumblockarrays,
+}
+_raw_readers = {}
+
+
+def _decoding_reader(cls):
+    # For fields that check what they read in a read method of their own
+    # or whose encoding has no raw reader. They are decoded for real and
+    # written out again.
+    def read_raw(stream, chunks):
+        field = cls().read(stream)
+        out_stream = io.BytesIO()
+        field.write(out_stream)
+        chunks.append(out_stream.getvalue())
+    return read_raw
+
+
+def _raw_reader(cls):
+    """ Returns a function that reads the encoded bytes of a field of type cls into a list of chunks """
+    try:
+        return _raw_readers[cls]
+    except KeyError:
+        base_type = next(t for t in cls.__mro__ if 'read' in vars(t))
+        if base_type is nbytes:
+            read_raw = _raw_fixed_reader(2 + len(cls().value))
+        elif base_type in _raw_readers_by_base_type:
+            read_raw = _raw_readers_by_base_type[base_type]
+        else:
+            read_raw = _decoding_reader(cls)
+        _raw_readers[cls] = read_raw
+        return read_raw
+
+
+def _read_lazily(stream):
+    enumid = struct.unpack('<H', stream.peek(2))[0]
+    cls = _enumfield_classes[enumid]
+    # Fields that check what they read in a read method of their own are
+    # decoded right away, so that they are rejected at the same moment as before
+    if 'read' in vars(cls):
+        return cls().read(stream)
+    chunks = []
+    _raw_reader(cls)(stream, chunks)
+    return rawfield(cls, b''.join(chunks))
+
+
+# ------------------------------------------------------------
+# templates
+# ------------------------------------------------------------
+
+class enumblockarraytemplate():
+    """
+    An enumblockarray that is encoded once, with holes left for the fields of
+    the given types. Filling in those fields produces something that can be
+    sent like the original message, without re-encoding everything else.
+    """
+    __slots__ = ('ident', 'segments', 'slot_types')
+
+    def __init__(self, msg, variable_types):
+        self.ident = msg.ident
+        self.segments = []
+        self.slot_types = []
+
+        stream = io.BytesIO()
+        stream.write(struct.pack('<HH', msg.ident, len(msg.content)))
+        pending_fields = []
+        for field in msg.content:
+            if type(field) in variable_types:
+                _write_fields(stream, pending_fields)
+                pending_fields = []
+                self.segments.append(stream.getvalue())
+                self.slot_types.append(type(field))
+                stream = io.BytesIO()
+            else:
+                pending_fields.append(field)
+        _write_fields(stream, pending_fields)
+        self.segments.append(stream.getvalue())
+
+    def fill(self, fields):
+        fields_by_type = {type(field): field for field in fields}
+        data = [self.segments[0]]
+        for slot_type, segment in zip(self.slot_types, self.segments[1:]):
+            stream = io.BytesIO()
+            fields_by_type[slot_type].write(stream)
+            data.append(stream.getvalue())
+            data.append(segment)
+        return encodedfragment(self.ident, b''.join(data))
+
+
+class serverlistrow():
+    """
+    The row of a server in the server list, encoded for players that see the
+    server at a particular address. Everything except the time remaining
+    (m02f4) is encoded once, so that filling in the time is all that is left
+    to do when a player requests the server list.
+    """
+    __slots__ = ('prefix', 'suffix')
+
+    def __init__(self, server, player_address):
+        fields = m00e9.server_row(server, player_address)
+        time_idx = next(idx for idx, field in enumerate(fields) if type(field) is m02f4)
+
+        stream = io.BytesIO()
+        stream.write(struct.pack('<H', len(fields)))
+        _write_fields(stream, fields[:time_idx])
+        self.prefix = stream.getvalue()
+
+        stream = io.BytesIO()
+        _write_fields(stream, fields[time_idx + 1:])
+        self.suffix = stream.getvalue()
+
+    def fill(self, time_remaining):
+        stream = io.BytesIO()
+        m02f4().set(time_remaining).write(stream)
+        return encodedfragment(None, self.prefix + stream.getvalue() + self.suffix)
+
+
+# ------------------------------------------------------------
+# ident to class lookup tables
+# ------------------------------------------------------------
+
+def _build_enumfield_class_table(prefix):
+    """ Map the ident of every class named <prefix>XXXX in this module to that class """
+    table = {}
+    for name, value in list(globals().items()):
+        if isinstance(value, type) and re.fullmatch(prefix + '[0-9a-f]{4}', name):
+            table[int(name[1:], 16)] = value
+    return table
+
+
+# Built once at import time so that decoding a field costs a single
+# dict lookup instead of formatting a class name and probing globals()
+_enumfield_classes = _build_enumfield_class_table('m')
+
+# Top level messages are aXXXX classes, falling back to mXXXX classes
+# for idents that have no top level message class of their own
+_top_level_enumfield_classes = dict(_enumfield_classes)
+_top_level_enumfield_classes.update(_build_enumfield_class_table('a'))
+
+
+def construct_top_level_enumfield(stream):
+    ident = struct.unpack('<H', stream.peek(2))[0]
+    obj = _top_level_enumfield_classes[ident]().read(stream)
     return obj
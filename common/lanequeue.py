@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from collections import deque
+import time
+
+import gevent.lock
+import gevent.queue
+
+
+class _Lane:
+    def __init__(self, name, weight, maxsize):
+        if weight < 1:
+            raise ValueError('The weight of lane %s must be at least 1' % name)
+        self.name = name
+        self.weight = weight
+        self.items = deque()
+        self.free_slots = gevent.lock.Semaphore(maxsize)
+        self.deficit = 0
+
+
+class PriorityLaneQueue:
+    """
+    A queue with a single consumer and separate lanes for different kinds
+    of items, so that a flood of items in one lane can't hold up the others.
+
+    Every lane has its own bound: put blocks only while the lane of the
+    item is full. get serves the lanes with deficit round robin, so each
+    lane with items waiting gets a share of the gets in proportion to its
+    weight, and items within a lane come out in the order they were put in.
+
+    Like InstrumentedQueue, it keeps track of how long the last item that
+    was taken out had waited (last_wait) and how many items were left in
+    all lanes (last_depth).
+    """
+    def __init__(self, lanes, classify):
+        """
+        :param lanes: a list of (name, weight, maxsize) tuples
+        :param classify: a function that returns the name of the lane for an item
+        """
+        self.lanes = [_Lane(name, weight, maxsize) for name, weight, maxsize in lanes]
+        self.lanes_by_name = {lane.name: lane for lane in self.lanes}
+        self.classify = classify
+        self.items_available = gevent.lock.Semaphore(0)
+        self.current_lane_index = 0
+        self.last_wait = 0.0
+        self.last_depth = 0
+
+    def put(self, item, block=True, timeout=None):
+        lane = self.lanes_by_name[self.classify(item)]
+        if not lane.free_slots.acquire(blocking=block, timeout=timeout):
+            raise gevent.queue.Full
+        lane.items.append((time.perf_counter(), item))
+        self.items_available.release()
+
+    def get(self, block=True, timeout=None):
+        if not self.items_available.acquire(blocking=block, timeout=timeout):
+            raise gevent.queue.Empty
+        lane = self._next_lane()
+        put_time, item = lane.items.popleft()
+        lane.free_slots.release()
+        self.last_wait = time.perf_counter() - put_time
+        self.last_depth = self.qsize()
+        return item
+
+    def _next_lane(self):
+        # Only called when there is at least one item, so this terminates
+        while True:
+            lane = self.lanes[self.current_lane_index]
+            if lane.items and lane.deficit >= 1:
+                lane.deficit -= 1
+                return lane
+            if not lane.items:
+                lane.deficit = 0
+            self.current_lane_index = (self.current_lane_index + 1) % len(self.lanes)
+            self.lanes[self.current_lane_index].deficit += self.lanes[self.current_lane_index].weight
+
+    def qsize(self):
+        return sum(len(lane.items) for lane in self.lanes)
+
+    def lane_sizes(self):
+        return {lane.name: len(lane.items) for lane in self.lanes}
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get()
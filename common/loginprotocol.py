@@ -24,7 +24,7 @@ import struct
 from common.connectionhandler import *
 from common.token_bucket import TokenBucket
 
-from .datatypes import construct_top_level_enumfield, m034a
+from .datatypes import construct_top_level_enumfield, encodedfragment, m034a
 
 
 def peekshort(infile):
@@ -48,26 +48,48 @@ def parseseqack(infile):
 
 
 class PacketReader:
+    """
+    Reads from a stream of received messages as if it was one continuous
+    stream of bytes. Instead of cutting off what was read, an offset into
+    the buffer is kept, so only the requested bytes are copied on a read.
+    The unread remainder is copied just once, when more data is received.
+    """
     def __init__(self, receive_func):
         self.buffer = bytes()
+        self.offset = 0
         self.receive_func = receive_func
 
     def prepare(self, length):
-        ''' Makes sure that at least length bytes are available in self.buffer '''
-        while len(self.buffer) < length:
-            message_data = self.receive_func()
-            self.buffer += message_data
+        ''' Makes sure that at least length bytes are available in self.buffer after self.offset '''
+        if len(self.buffer) - self.offset < length:
+            received = [self.buffer[self.offset:]]
+            received_length = len(received[0])
+            while received_length < length:
+                message_data = self.receive_func()
+                received.append(message_data)
+                received_length += len(message_data)
+            self.buffer = b''.join(received)
+            self.offset = 0
 
     def read(self, length):
-        self.prepare(length)
-        requestedbytes = self.buffer[:length]
-        self.buffer = self.buffer[length:]
+        end = self.offset + length
+        if end > len(self.buffer):
+            self.prepare(length)
+            end = length
+        requestedbytes = self.buffer[self.offset:end]
+        self.offset = end
         return requestedbytes
 
     def peek(self, length):
-        self.prepare(length)
-        requestedbytes = self.buffer[:length]
-        return requestedbytes
+        end = self.offset + length
+        if end > len(self.buffer):
+            self.prepare(length)
+            end = length
+        return self.buffer[self.offset:end]
+
+    def available(self):
+        ''' Returns the number of bytes that can be read without receiving more data '''
+        return len(self.buffer) - self.offset
 
     def tell(self):
         return 0
@@ -112,7 +134,8 @@ class LoginProtocolMessage():
 
 class LoginProtocolReader(TcpMessageConnectionReader):
     def __init__(self, sock, dump_queue, token_bucket_data: TokenBucket = None, token_bucket_msgs: TokenBucket = None):
-        super().__init__(sock, max_message_size=1450, dump_queue=dump_queue, token_bucket=token_bucket_data)
+        super().__init__(sock, max_message_size=1450, dump_queue=dump_queue, token_bucket=token_bucket_data,
+                         buffered=True)
         packet_reader = PacketReader(super().receive)
         self.stream_parser = StreamParser(packet_reader)
         self.token_bucket_msgs = token_bucket_msgs
@@ -128,14 +151,24 @@ class LoginProtocolReader(TcpMessageConnectionReader):
 
 
 class LoginProtocolWriter(TcpMessageConnectionWriter):
-    def __init__(self, sock, dump_queue):
-        super().__init__(sock, max_message_size = 1450, dump_queue = dump_queue)
+    def __init__(self, sock, dump_queue, coalesce = True, coalesce_delay = 0):
+        super().__init__(sock, max_message_size = 1450, dump_queue = dump_queue, coalesce = coalesce,
+                         coalesce_delay = coalesce_delay)
         self.seq = None
 
     def encode(self, msg_tuple):
-        stream = io.BytesIO()
         message, ack = msg_tuple
 
+        if type(message) is encodedfragment:
+            # Already encoded once for all recipients; only the trailer is our own
+            if self.seq is None:
+                self.seq = 0
+                return message.data
+            trailer = struct.pack('<LL', self.seq, ack or 0)
+            self.seq += 1
+            return message.data + trailer
+
+        stream = io.BytesIO()
         if isinstance(message, list):
             for el in message:
                 el.write(stream)
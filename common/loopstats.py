@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import bisect
+from collections import deque
+import time
+
+import gevent.queue
+
+# Upper bounds in seconds of the buckets of the latency histograms; the
+# last bucket holds everything slower than the last bound
+LATENCY_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0)
+LATENCY_BUCKET_NAMES = ['<0.1ms', '<1ms', '<10ms', '<100ms', '<1s', '>=1s']
+
+
+class InstrumentedQueue(gevent.queue.Queue):
+    """
+    A queue that remembers when each item was put into it, so that the
+    consumer can find out how long the item it just got had to wait
+    (last_wait) and how many items were still queued behind it
+    (last_depth).
+    """
+    def __init__(self, maxsize=None):
+        super().__init__(maxsize=maxsize)
+        self.put_times = deque()
+        self.last_wait = 0.0
+        self.last_depth = 0
+
+    def _put(self, item):
+        self.put_times.append(time.perf_counter())
+        super()._put(item)
+
+    def _get(self):
+        item = super()._get()
+        self.last_wait = time.perf_counter() - self.put_times.popleft()
+        self.last_depth = len(self.put_times)
+        return item
+
+
+class HandlerStats:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.max_wait = 0.0
+        self.histogram = [0] * len(LATENCY_BUCKET_NAMES)
+
+    def record(self, duration, wait):
+        self.count += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.max_wait = max(self.max_wait, wait)
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'avg_ms': self.total_time / self.count * 1000 if self.count else 0.0,
+            'max_ms': self.max_time * 1000,
+            'max_wait_ms': self.max_wait * 1000,
+            'histogram': dict(zip(LATENCY_BUCKET_NAMES, self.histogram)),
+        }
+
+
+class MessageLoopStats:
+    """
+    Statistics of a loop that takes messages from a queue and handles them
+    one at a time: per message type how many were handled, how long that
+    took and how long they had to wait in the queue, as well as the depth
+    of the queue and the fraction of time the loop was busy.
+
+    Handlers can break their own time down further with record_part, for
+    instance per login protocol request. That time is already counted for
+    the message the handler was called for.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.start_time = time.perf_counter()
+        self.message_stats = {}
+        self.part_stats = {}
+        self.busy_time = 0.0
+        self.depth_samples = 0
+        self.total_depth = 0
+        self.max_depth = 0
+        self.interval_start_time = self.start_time
+        self.interval_busy_time = 0.0
+
+    def record_message(self, message_type, duration, queue):
+        wait = getattr(queue, 'last_wait', 0.0)
+        depth = getattr(queue, 'last_depth', 0)
+
+        stats = self.message_stats.get(message_type)
+        if stats is None:
+            stats = self.message_stats[message_type] = HandlerStats()
+        stats.record(duration, wait)
+
+        self.busy_time += duration
+        self.interval_busy_time += duration
+        self.depth_samples += 1
+        self.total_depth += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def record_part(self, part, duration):
+        stats = self.part_stats.get(part)
+        if stats is None:
+            stats = self.part_stats[part] = HandlerStats()
+        stats.record(duration, 0.0)
+
+    def to_dict(self):
+        elapsed = time.perf_counter() - self.start_time
+        return {
+            'name': self.name,
+            'uptime_s': elapsed,
+            'utilisation': self.busy_time / elapsed if elapsed else 0.0,
+            'queue_depth': {
+                'avg': self.total_depth / self.depth_samples if self.depth_samples else 0.0,
+                'max': self.max_depth,
+            },
+            'messages': {name: stats.to_dict() for name, stats in sorted(self.message_stats.items())},
+            'parts': {name: stats.to_dict() for name, stats in sorted(self.part_stats.items())},
+        }
+
+    def log_summary(self, logger, top=5):
+        """ Logs the busiest handlers and the utilisation since the previous summary """
+        now = time.perf_counter()
+        interval = now - self.interval_start_time
+        utilisation = self.interval_busy_time / interval if interval else 0.0
+        self.interval_start_time = now
+        self.interval_busy_time = 0.0
+
+        slowest = sorted(self.message_stats.items(), key=lambda item: item[1].max_time, reverse=True)[:top]
+        logger.info('%s loop: %.1f%% busy over the last %d seconds, queue depth avg %.1f max %d; '
+                    'slowest handlers: %s' %
+                    (self.name, utilisation * 100, interval,
+                     self.total_depth / self.depth_samples if self.depth_samples else 0.0, self.max_depth,
+                     ', '.join('%s %.1fms max (%d handled, waited up to %.1fms)' %
+                               (name, stats.max_time * 1000, stats.count, stats.max_wait * 1000)
+                               for name, stats in slowest)))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from functools import wraps
+
+
+def handles(packet):
+    """
+    A decorator that defines a function as a handler for a certain packet
+    :param packet: the packet being handled by the function
+    """
+
+    def real_decorator(func):
+        func.handles_packet = packet
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return real_decorator
+
+
+def handles_control_message(messageType):
+    """
+    A decorator that defines a function as a handler for a certain control message
+    :param messageType: the type of control message this function handles
+    """
+
+    def real_decorator(func):
+        func.handles_message = messageType
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return func(*args, **kwargs)
+        return wrapper
+
+    return real_decorator
+
+
+def _collect_handlers(cls, attribute):
+    """
+    Builds a table from handled type to unbound handler for a class.
+    Handlers are looked up by name along the MRO just like normal attribute
+    access, so a subclass can replace a handler by overriding it, but two
+    differently named handlers for the same type are an error.
+    """
+    members = {}
+    for klass in reversed(cls.__mro__):
+        members.update(vars(klass))
+
+    handlers = {}
+    for name, func in members.items():
+        handled_type = getattr(func, attribute, None)
+        if handled_type is None:
+            continue
+        if handled_type in handlers:
+            raise ValueError('Duplicate handlers found in %s for %s: %s and %s' %
+                             (cls.__name__, handled_type.__name__, handlers[handled_type].__name__, name))
+        handlers[handled_type] = func
+    return handlers
+
+
+class HandlerRegistry:
+    """
+    Base class for anything that dispatches messages to methods decorated with
+    @handles or @handles_control_message. The tables mapping a message type to
+    its unbound handler are built once, when a subclass is defined.
+    """
+    packet_handlers = {}
+    control_message_handlers = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.packet_handlers = _collect_handlers(cls, 'handles_packet')
+        cls.control_message_handlers = _collect_handlers(cls, 'handles_message')
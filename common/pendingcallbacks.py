@@ -23,21 +23,24 @@ from common import utils
 
 
 class ExecuteCallbackMessage():
-    def __init__(self, callback_id):
+    def __init__(self, callback_id, receiver=None):
         self.callback_id = callback_id
+        self.receiver = receiver
 
 
 class PendingCallbacks:
     def __init__(self, server_queue):
         self.server_queue = server_queue
         self.callbacks = {}
+        self.callback_ids = utils.IdAllocator(0)
 
     def add(self, receiver, seconds_from_now, callback_func):
-        callback_id = utils.first_unused_number_above(self.callbacks.keys(), 0)
+        callback_id = self.callback_ids.allocate()
 
         self.callbacks[callback_id] = {'receiver_id': id(receiver),
                                        'callback_func': callback_func }
-        gevent_spawn_later('pending callback for %s' % receiver, seconds_from_now, self._post_callback, callback_id)
+        gevent_spawn_later('pending callback for %s' % receiver, seconds_from_now, self._post_callback,
+                           callback_id, receiver)
 
     def remove_receiver(self, receiver):
         for callback_id, callback in self.callbacks.items():
@@ -45,8 +48,8 @@ class PendingCallbacks:
                 # Only disable callbacks here, removal is done when the callback is fired
                 callback['callback_func'] = None
 
-    def _post_callback(self, callback_id):
-        self.server_queue.put(ExecuteCallbackMessage(callback_id))
+    def _post_callback(self, callback_id, receiver):
+        self.server_queue.put(ExecuteCallbackMessage(callback_id, receiver))
 
     def execute(self, callback_id):
         assert callback_id in self.callbacks, "Callback not found. A callback should only be removed by " \
@@ -55,4 +58,5 @@ class PendingCallbacks:
         if self.callbacks[callback_id]['callback_func'] is not None:
             self.callbacks[callback_id]['callback_func']()
         del self.callbacks[callback_id]
+        self.callback_ids.release(callback_id)
 
@@ -18,14 +18,31 @@
 # along with taserver.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import io
+import os
 import struct
 from common.token_bucket import TokenBucket
 from common.errors import RateLimitError
 
 
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+
+
 class TcpMessageReader:
-    def __init__(self, socket, max_message_size = 0xFFFF, dump_queue = None, token_bucket: TokenBucket = None):
+    """
+    Receives length-prefixed messages from a socket.
+
+    By default every message takes two reads from the socket, one for the
+    length and one for the body. In buffered mode the socket is instead read
+    in large chunks into a buffer, from which as many messages are taken as
+    it holds before the socket is read again. A buffered reader may receive
+    more than one message at a time, so it must be used for all reads from
+    its socket.
+    """
+    def __init__(self, socket, max_message_size = 0xFFFF, dump_queue = None, token_bucket: TokenBucket = None,
+                 buffered = False, buffer_size = 0x10000):
         self.socket = socket
         self.max_message_size = max_message_size
         self.dump_queue = dump_queue
@@ -33,6 +50,14 @@ class TcpMessageReader:
         if self.max_message_size > 0xFFFF:
             raise ValueError('max_message_size is not allowed to be greater than 0xFFFF')
 
+        self.buffered = buffered
+        if buffered:
+            self.buffer = bytearray(max(buffer_size, 2 + max_message_size))
+            self.view = memoryview(self.buffer)
+            self.start = 0
+            self.end = 0
+            self.packet_size = None
+
     def _recvall(self, size):
         remaining_size = size
         msg = bytes()
@@ -44,16 +69,22 @@ class TcpMessageReader:
             msg += chunk
         return msg
 
-    def receive(self):
-        packet_size_bytes = self._recvall(2)
-        packet_size = struct.unpack('<H', packet_size_bytes)[0]
+    def _check_packet_size(self, packet_size):
         if packet_size == 0:
             packet_size = self.max_message_size
         elif packet_size > self.max_message_size:
             raise RuntimeError('Received a packet size that is larger than the TcpMessageReader was created for')
-        
+
         if self.token_bucket and not self.token_bucket.consume(packet_size):
             raise RateLimitError(f'exceeded token bucket limit of {str(self.token_bucket)}')
+        return packet_size
+
+    def receive(self):
+        if self.buffered:
+            return self._receive_buffered()
+
+        packet_size_bytes = self._recvall(2)
+        packet_size = self._check_packet_size(struct.unpack('<H', packet_size_bytes)[0])
 
         packet_body_bytes = self._recvall(packet_size)
         if self.dump_queue:
@@ -63,6 +94,37 @@ class TcpMessageReader:
                                (len(packet_body_bytes), packet_size))
         return packet_body_bytes
 
+    def _receive_buffered(self):
+        while True:
+            if self.packet_size is None and self.end - self.start >= 2:
+                # Checked as soon as the size is known, just like in unbuffered mode
+                self.packet_size = self._check_packet_size(struct.unpack_from('<H', self.buffer, self.start)[0])
+
+            if self.packet_size is not None and self.end - self.start >= 2 + self.packet_size:
+                packet_start = self.start
+                packet_end = packet_start + 2 + self.packet_size
+                self.start = packet_end
+                self.packet_size = None
+                if self.dump_queue:
+                    self.dump_queue.put(('tcpreader', bytes(self.view[packet_start:packet_end])))
+                return bytes(self.view[packet_start + 2:packet_end])
+
+            self._fill_buffer()
+
+    def _fill_buffer(self):
+        # Move the incomplete packet at the end of the buffer to the front, so
+        # that there is always room for the rest of it
+        if self.start > 0:
+            remaining = self.end - self.start
+            self.view[:remaining] = bytes(self.view[self.start:self.end])
+            self.start = 0
+            self.end = remaining
+
+        received = self.socket.recv_into(self.view[self.end:])
+        if not received:
+            raise ConnectionResetError()
+        self.end += received
+
 
 class TcpMessageWriter:
     def __init__(self, socket, max_message_size = 0xFFFF, dump_queue = None):
@@ -73,19 +135,45 @@ class TcpMessageWriter:
             raise ValueError('max_message_size is not allowed to be greater than 0xFFFF')
 
     def send(self, data):
-        size = len(data)
-        if size == 0:
-            raise ValueError('TcpMessageWriter: Sending empty messages is not allowed')
-        output_buffer = io.BytesIO()
-        while size > 0:
-            output_buffer.write(struct.pack('<H', size if size < self.max_message_size else 0))
-            output_buffer.write(data[:self.max_message_size])
-            data = data[self.max_message_size:]
-            size = len(data)
+        self.send_multiple([data])
 
-        if self.dump_queue:
-            self.dump_queue.put(('tcpwriter', output_buffer.getvalue()))
-        self.socket.sendall(output_buffer.getvalue())
+    def send_multiple(self, messages):
+        """ Send several messages, each split into its own packets, with as few writes to the socket as possible """
+        buffers = []
+        for data in messages:
+            if len(data) == 0:
+                raise ValueError('TcpMessageWriter: Sending empty messages is not allowed')
+            data = memoryview(data)
+            message_start = len(buffers)
+            for offset in range(0, len(data), self.max_message_size):
+                packet_body = data[offset:offset + self.max_message_size]
+                packet_size = len(packet_body) if len(packet_body) < self.max_message_size else 0
+                buffers.append(struct.pack('<H', packet_size))
+                buffers.append(packet_body)
+
+            if self.dump_queue:
+                self.dump_queue.put(('tcpwriter', b''.join(buffers[message_start:])))
+
+        self._sendall_buffers(buffers)
+
+    def _sendall_buffers(self, buffers):
+        """ Send all buffers with as few system calls as possible, without joining them first """
+        if not hasattr(self.socket, 'sendmsg'):
+            # Sockets on Windows don't have sendmsg
+            self.socket.sendall(b''.join(buffers))
+            return
+
+        first = 0
+        while first < len(buffers):
+            sent = self.socket.sendmsg(buffers[first:first + _IOV_MAX])
+
+            # Skip the buffers that were sent completely and
+            # continue with the rest of a partially sent one
+            while first < len(buffers) and sent >= len(buffers[first]):
+                sent -= len(buffers[first])
+                first += 1
+            if sent:
+                buffers[first] = memoryview(buffers[first])[sent:]
 
     def close(self):
         self.socket.close()
@@ -18,6 +18,8 @@
 # along with taserver.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import bisect
+from collections import OrderedDict
 import os
 
 MIN_UNVERIFIED_ID = 1000000
@@ -32,12 +34,93 @@ def get_shared_ini_path(data_root):
     return os.path.join(data_root, 'shared.ini')
 
 
-def first_unused_number_above(numbers, minimum, maximum=None):
-    used_numbers = (n for n in numbers if n >= minimum)
-    first_number_above = next(i for i, e in enumerate(sorted(used_numbers) + [None], start=minimum) if i != e)
-    if maximum is not None and first_number_above > maximum:
-        raise RuntimeError('Unable to allocate an unused number between {minimum} and {maximum}. All are in use.')
-    return first_number_above
+class IdAllocator:
+    """
+    Hands out the lowest number between minimum and maximum that is not in
+    use, so that ids stay compact. Unused numbers below the high-water mark
+    are kept as a sorted list of (start, end) ranges, with adjacent ranges
+    merged, and everything from the high-water mark upwards has never been
+    used. So memory depends on the number of gaps rather than on how large
+    the ids in use are. Finding the place of a released number is a binary
+    search, but adding or removing a range moves the ranges after it in the
+    list, so allocate and release take O(r) for r ranges. That is a memmove
+    of a short list in practice, because released numbers next to each other
+    merge and allocate always takes from the first range.
+    """
+    def __init__(self, minimum, maximum=None, used_ids=()):
+        self.minimum = minimum
+        self.maximum = maximum
+        used_ids = sorted(set(i for i in used_ids if self.in_range(i)))
+        self.next_id = used_ids[-1] + 1 if used_ids else minimum
+        # Half-open ranges of numbers below next_id that are not in use
+        self.free_ranges = []
+        expected_id = minimum
+        for used_id in used_ids:
+            if expected_id < used_id:
+                self.free_ranges.append((expected_id, used_id))
+            expected_id = used_id + 1
+
+    def in_range(self, number):
+        return number >= self.minimum and (self.maximum is None or number <= self.maximum)
+
+    def allocate(self):
+        if self.free_ranges:
+            start, end = self.free_ranges[0]
+            if start + 1 < end:
+                self.free_ranges[0] = (start + 1, end)
+            else:
+                del self.free_ranges[0]
+            return start
+
+        if self.maximum is not None and self.next_id > self.maximum:
+            raise RuntimeError(f'Unable to allocate an unused number between {self.minimum} and {self.maximum}. '
+                               f'All are in use.')
+        number = self.next_id
+        self.next_id += 1
+        return number
+
+    def release(self, number):
+        # Index of the first range that starts after number
+        idx = bisect.bisect_right(self.free_ranges, (number, float('inf')))
+        previous_range = self.free_ranges[idx - 1] if idx > 0 else None
+        if not (self.in_range(number) and number < self.next_id and
+                (previous_range is None or previous_range[1] <= number)):
+            raise ValueError(f'Number {number} was not allocated and cannot be released')
+
+        start, end = number, number + 1
+        if previous_range is not None and previous_range[1] == number:
+            start = previous_range[0]
+            idx -= 1
+            del self.free_ranges[idx]
+        if idx < len(self.free_ranges) and self.free_ranges[idx][0] == end:
+            end = self.free_ranges[idx][1]
+            del self.free_ranges[idx]
+        self.free_ranges.insert(idx, (start, end))
+
+
+class IdentityCache:
+    """
+    Remembers what compute returned for an object, looked up by the identity
+    of the object so that it doesn't have to be hashable. Each object is kept
+    alive while it is cached, so its id can't be reused for another object.
+    When more than maxsize objects are cached, the one used least recently
+    is forgotten.
+    """
+    def __init__(self, compute, maxsize):
+        self.compute = compute
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, obj):
+        entry = self.entries.get(id(obj))
+        if entry is None:
+            entry = (obj, self.compute(obj))
+            self.entries[id(obj)] = entry
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(id(obj))
+        return entry[1]
 
 
 def is_valid_ascii_for_name(ascii_bytes):
@@ -22,12 +22,14 @@ from distutils.version import StrictVersion
 import gevent
 import logging
 import os
+import time
 
 from common.errors import FatalError
 from common.firewall import FirewallClient
 from common.ipaddresspair import IPAddressPair
 from common.messages import *
 from common.connectionhandler import PeerConnectedMessage, PeerDisconnectedMessage
+from common.loopstats import MessageLoopStats
 from common.statetracer import statetracer, TracingDict
 from common.pendingcallbacks import PendingCallbacks, ExecuteCallbackMessage
 from common import versions
@@ -37,6 +39,8 @@ from .gameserverhandler import StartGameServerMessage, StopGameServerMessage, \
                                 GameServerTerminatedMessage
 from .loginserverhandler import LoginServer
 
+LOOP_STATS_LOG_INTERVAL = 600
+
 
 class GameServerProcess:
     def __init__(self, name, ports, server_handler_queue):
@@ -134,6 +138,9 @@ class Launcher:
         else:
             self.logger.info('launcher: detected internal IP: %s' % self.address_pair.internal_ip)
 
+        self.loop_stats = MessageLoopStats('launcher')
+        self.pending_callbacks.add(self, LOOP_STATS_LOG_INTERVAL, self.log_loop_stats)
+
         self.message_handlers = {
             PeerConnectedMessage: self.handle_peer_connected,
             PeerDisconnectedMessage: self.handle_peer_disconnected,
@@ -162,8 +169,15 @@ class Launcher:
         self.pending_server.start()
         while True:
             for message in self.incoming_queue:
+                start_time = time.perf_counter()
                 handler = self.message_handlers[type(message)]
                 handler(message)
+                self.loop_stats.record_message(type(message).__name__, time.perf_counter() - start_time,
+                                               self.incoming_queue)
+
+    def log_loop_stats(self):
+        self.loop_stats.log_summary(self.logger)
+        self.pending_callbacks.add(self, LOOP_STATS_LOG_INTERVAL, self.log_loop_stats)
 
     def get_other_server(self, server):
         for other_server in ['gameserver1', 'gameserver2']:
@@ -28,6 +28,7 @@ import os
 from common.errors import FatalError
 from common.geventwrapper import gevent_spawn
 from common.logging import set_up_logging
+from common.loopstats import InstrumentedQueue
 from common.ports import Ports
 from common.utils import get_shared_ini_path
 from .gamecontrollerhandler import handle_game_controller
@@ -64,7 +65,7 @@ def main():
     tasks = []
     try:
         while restart:
-            incoming_queue = gevent.queue.Queue()
+            incoming_queue = InstrumentedQueue()
             server_handler_queue = gevent.queue.Queue()
 
             tasks = [
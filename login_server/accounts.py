@@ -41,6 +41,8 @@ class Accounts:
         self.filename = filename
         self.accounts = {}
         self.load()
+        self.unique_ids = utils.IdAllocator(utils.MIN_VERIFIED_ID, utils.MAX_VERIFIED_ID,
+                                            (account.unique_id for account in self.accounts.values()))
 
     def load(self):
         try:
@@ -104,8 +106,7 @@ class Accounts:
             account.authcode = authcode
             account.authcode_time = datetime.now()
         else:
-            used_ids = {account.unique_id for account in self.accounts.values()}
-            unique_id = utils.first_unused_number_above(used_ids, utils.MIN_VERIFIED_ID, utils.MAX_VERIFIED_ID)
+            unique_id = self.unique_ids.allocate()
             account = AccountInfo(unique_id, login_name, email_hash, authcode, datetime.now())
             self.accounts[login_name] = account
 
@@ -116,6 +117,7 @@ class Accounts:
                self.accounts[login_name].authcode_time is not None and \
                self.accounts[login_name].authcode_time < datetime.now() - timedelta(hours=4):
                 if self.accounts[login_name].password_hash is None:
+                    self.unique_ids.release(self.accounts[login_name].unique_id)
                     del self.accounts[login_name]
                 else:
                     self.accounts[login_name].authcode = None
@@ -25,13 +25,15 @@ from common.token_bucket import TokenBucketPool
 
 
 class GameClientHandler(IncomingConnectionHandler):
-    def __init__(self, incoming_queue, dump_queue, data_root):
+    def __init__(self, incoming_queue, dump_queue, data_root, coalesce=True, coalesce_delay=0):
         super().__init__('gameclient',
                          '0.0.0.0',
                          9000,
                          incoming_queue)
         self.dump_queue = dump_queue
         self.data_root = data_root
+        self.coalesce = coalesce
+        self.coalesce_delay = coalesce_delay
         self.token_bucket_data_pool = TokenBucketPool(10000, 60, 'bytes') # 10KB/min per IP
         self.token_bucket_msgs_pool = TokenBucketPool(100, 60, 'messages') # 100msgs/min per IP
 
@@ -39,11 +41,11 @@ class GameClientHandler(IncomingConnectionHandler):
         reader = LoginProtocolReader(sock, self.dump_queue,
                                      token_bucket_data=self.token_bucket_data_pool.get(address[0]),
                                      token_bucket_msgs=self.token_bucket_msgs_pool.get(address[0]))
-        writer = LoginProtocolWriter(sock, self.dump_queue)
+        writer = LoginProtocolWriter(sock, self.dump_queue, coalesce=self.coalesce, coalesce_delay=self.coalesce_delay)
         peer = Player(address, self.data_root)
         return reader, writer, peer
 
 
-def handle_game_client(incoming_queue, dump_queue, data_root):
-    game_client_handler = GameClientHandler(incoming_queue, dump_queue, data_root)
+def handle_game_client(incoming_queue, dump_queue, data_root, coalesce=True, coalesce_delay=0):
+    game_client_handler = GameClientHandler(incoming_queue, dump_queue, data_root, coalesce, coalesce_delay)
     game_client_handler.run()
@@ -32,7 +32,7 @@ import time
 import urllib.request
 
 
-from common.connectionhandler import Peer
+from common.connectionhandler import Peer, PeerQueue
 from common.datatypes import *
 from common.firewall import FirewallClient
 from common.messages import Login2LauncherNextMapMessage, \
@@ -67,6 +67,10 @@ global_rate_limiter = RateLimiter()
              'players', 'player_being_kicked', 'match_end_time_rel_or_abs', 'match_time_counting',
              'be_score', 'ds_score', 'map_id', )
 class GameServer(Peer):
+    # Messages to game servers can't be dropped, but a launcher can lag
+    # behind for a while before it gets disconnected
+    outgoing_queue_policy = PeerQueue.POLICY_SPILL
+
     def __init__(self, detected_ip: IPv4Address, ports, shared_config):
         super().__init__()
 
@@ -102,6 +106,9 @@ class GameServer(Peer):
         self.map_votes = {}
         self.next_map_idx = None
 
+        # Encoded rows for the server list, per address at which players see this server
+        self.server_list_rows = {}
+
         continent_code_to_region = {
             'NA': REGION_NORTH_AMERICA,
             'EU': REGION_EUROPE,
@@ -146,6 +153,7 @@ class GameServer(Peer):
 
     def set_address_info(self, address_pair):
         self.address_pair = address_pair
+        self.server_list_rows.clear()
         self.send_pings()
 
     def set_info(self, description: str, motd: str, game_setting_mode: str, password_hash: bytes):
@@ -153,6 +161,16 @@ class GameServer(Peer):
         self.motd = motd
         self.game_setting_mode = game_setting_mode
         self.password_hash = password_hash
+        self.server_list_rows.clear()
+
+    def set_map_id(self, map_id):
+        self.map_id = map_id
+        self.server_list_rows.clear()
+
+    def set_score(self, be_score, ds_score):
+        self.be_score = be_score
+        self.ds_score = ds_score
+        self.server_list_rows.clear()
 
     def set_match_time(self, seconds_remaining, counting):
         self.match_time_counting = counting
@@ -160,8 +178,10 @@ class GameServer(Peer):
             self.match_end_time_rel_or_abs = int(time.time() + seconds_remaining)
         else:
             self.match_end_time_rel_or_abs = seconds_remaining
+        self.server_list_rows.clear()
 
     def set_ready(self, port, pingport):
+        self.server_list_rows.clear()
         if port is not None:
             self.be_score = 0
             self.ds_score = 0
@@ -194,9 +214,18 @@ class GameServer(Peer):
 
         return time_remaining
 
+    def get_server_list_row(self, player_address):
+        address_seen = self.address_pair.get_address_seen_from(player_address)
+        row = self.server_list_rows.get(address_seen)
+        if row is None:
+            row = serverlistrow(self, player_address)
+            self.server_list_rows[address_seen] = row
+        return row.fill(self.get_time_remaining())
+
     def add_player(self, player):
         assert player.unique_id not in self.players
         self.players[player.unique_id] = player
+        self.server_list_rows.clear()
         player.vote = None
         player_ip = player.address_pair.get_address_seen_from(self.address_pair)
         msg = Login2LauncherAddPlayer(player.unique_id,
@@ -209,31 +238,38 @@ class GameServer(Peer):
     def remove_player(self, player):
         assert player.unique_id in self.players
         del self.players[player.unique_id]
+        self.server_list_rows.clear()
         player_ip = player.address_pair.get_address_seen_from(self.address_pair)
         msg = Login2LauncherRemovePlayer(player.unique_id,
                                          str(player_ip) if player_ip is not None else '')
         self.send(msg)
 
     def _send_public_message_from_server(self, text):
+        # Only the name of the recipient differs between players
+        template = enumblockarraytemplate(a0070().set([
+            m009e().set(MESSAGE_PUBLIC),
+            m02e6().set(text),
+            m034a(),
+            m0574(),
+            m02fe().set('taserver'),
+            m06de().set('bot')
+        ]), (m034a,))
         for player in self.players.values():
-            msg = a0070().set([
-                m009e().set(MESSAGE_PUBLIC),
-                m02e6().set(text),
-                m034a().set(player.display_name),
-                m0574(),
-                m02fe().set('taserver'),
-                m06de().set('bot')
-            ])
-            player.send(msg)
+            player.send(template.fill([m034a().set(player.display_name)]))
 
     def send_all_players(self, data):
-        for player in self.players.values():
-            player.send(data)
+        if self.players:
+            fragment = encodedfragment.from_message(data)
+            for player in self.players.values():
+                player.send(fragment)
 
     def send_all_players_on_team(self, data, team):
+        fragment = None
         for player in self.players.values():
             if player.team == team:
-                player.send(data)
+                if fragment is None:
+                    fragment = encodedfragment.from_message(data)
+                player.send(fragment)
 
     def set_player_loadouts(self, player):
         assert player.unique_id in self.players
@@ -24,12 +24,15 @@ import hashlib
 import logging
 import random
 import string
+import time
 
-from common.connectionhandler import PeerConnectedMessage, PeerDisconnectedMessage
+from common.connectionhandler import PeerConnectedMessage, PeerDisconnectedMessage, \
+    connection_writer_counters, peer_queue_counters
 from common.datatypes import *
 from common.firewall import FirewallClient
 from common.ipaddresspair import IPAddressPair
 from common.loginprotocol import LoginProtocolMessage
+from common.loopstats import MessageLoopStats
 from common.messages import *
 from common.statetracer import statetracer, TracingDict
 from common.versions import launcher2loginserver_protocol_version
@@ -39,16 +42,42 @@ from common.pendingcallbacks import PendingCallbacks, ExecuteCallbackMessage
 from .player.player import Player
 from .player.state.offline_state import OfflineState
 from .player.state.unauthenticated_state import UnauthenticatedState
+from .playerindex import PlayerIndex
 from .protocol_errors import ProtocolViolationError
-from .social_network import SocialNetwork
+from .social_network import SocialNetwork, DEFAULT_FRIEND_LIST_THRESHOLD
 from common import utils
 
 UNUSED_AUTHCODE_CHECK_TIME = 3600
+LOOP_STATS_LOG_INTERVAL = 600
+
+# Lanes of the server queue as (name, weight, maxsize). Game server, launcher
+# and authbot traffic goes in the control lane and callbacks in the timers lane,
+# so neither has to wait behind a flood of client traffic. Messages are only
+# kept in order within a lane, so everything that concerns a single player
+# goes in the clients lane: otherwise one of its callbacks could run after
+# its connection was gone, but before its disconnect was handled.
+SERVER_QUEUE_LANES = [
+    ('control', 4, 100),
+    ('timers', 2, 100),
+    ('clients', 1, 100),
+]
+
+
+def server_queue_lane(message):
+    if isinstance(message, ExecuteCallbackMessage):
+        return 'clients' if isinstance(message.receiver, Player) else 'timers'
+    elif isinstance(getattr(message, 'peer', None), (GameServer, AuthCodeRequester)):
+        return 'control'
+    else:
+        # All messages of a single player (and HTTP requests) share a lane,
+        # so they are still handled in the order in which they arrived
+        return 'clients'
 
 
 @statetracer('address_pair', 'game_servers', 'players')
 class LoginServer:
-    def __init__(self, server_queue, client_queues, server_stats_queue, ports, accounts, shared_config, account_verification_enabled):
+    def __init__(self, server_queue, client_queues, server_stats_queue, ports, accounts, shared_config, account_verification_enabled,
+                 friend_list_threshold=DEFAULT_FRIEND_LIST_THRESHOLD):
         self.logger = logging.getLogger(__name__)
         self.server_queue = server_queue
         self.client_queues = client_queues
@@ -58,7 +87,14 @@ class LoginServer:
         self.game_servers = TracingDict()
 
         self.players = TracingDict()
-        self.social_network = SocialNetwork()
+        self.unverified_player_ids = utils.IdAllocator(utils.MIN_UNVERIFIED_ID, utils.MAX_UNVERIFIED_ID)
+        self.server_ids = utils.IdAllocator(1)
+        self.player_indexes = {
+            'display_name': PlayerIndex('display_name', key_func=str.lower),
+            'login_name': PlayerIndex('login_name'),
+            'game_server': PlayerIndex('game_server'),
+        }
+        self.social_network = SocialNetwork(friend_list_threshold)
         self.firewall = FirewallClient(ports, shared_config)
         self.accounts = accounts
         self.message_handlers = {
@@ -94,7 +130,17 @@ class LoginServer:
         else:
             self.logger.info('detected external IP: %s' % self.address_pair.external_ip)
 
+        self.loop_stats = MessageLoopStats('loginserver')
         self.pending_callbacks.add(self, 0, self.remove_old_authcodes)
+        self.pending_callbacks.add(self, LOOP_STATS_LOG_INTERVAL, self.log_loop_stats)
+
+    def log_loop_stats(self):
+        self.loop_stats.log_summary(self.logger)
+        self.logger.info('connection writers sent %d messages in %d sends (%d bytes); outgoing queues: %s' %
+                         (connection_writer_counters['messages'], connection_writer_counters['sends'],
+                          connection_writer_counters['bytes'], dict(peer_queue_counters)))
+        self.logger.info('presence notifications: %s' % self.social_network.notification_stats())
+        self.pending_callbacks.add(self, LOOP_STATS_LOG_INTERVAL, self.log_loop_stats)
 
     def remove_old_authcodes(self):
         if self.accounts.remove_old_authcodes():
@@ -107,6 +153,7 @@ class LoginServer:
         self.firewall.reset_firewall('blacklist')
         while True:
             for message in self.server_queue:
+                start_time = time.perf_counter()
                 handler = self.message_handlers[type(message)]
                 try:
                     handler(message)
@@ -116,6 +163,9 @@ class LoginServer:
                         message.peer.disconnect(e)
                     else:
                         raise
+                self.social_network.flush_notifications()
+                self.loop_stats.record_message(type(message).__name__, time.perf_counter() - start_time,
+                                               self.server_queue)
 
     def all_game_servers(self):
         return self.game_servers
@@ -141,20 +191,38 @@ class LoginServer:
         return matching_players[0] if matching_players else None
 
     def find_players_by(self, **kwargs):
-        matching_players = self.players.values()
+        indexed_keys = [key for key, val in kwargs.items() if key in self.player_indexes and val is not None]
+        if indexed_keys:
+            key = indexed_keys[0]
+            matching_players = list(self.player_indexes[key].find(kwargs[key]))
+        else:
+            matching_players = self.players.values()
+
         for key, val in kwargs.items():
             matching_players = [player for player in matching_players if getattr(player, key) == val]
 
         return matching_players
 
     def find_player_by_display_name(self, display_name):
-        matching_players = [p for p in self.players.values()
-                            if p.display_name is not None and p.display_name.lower() == display_name.lower()]
+        matching_players = self.player_indexes['display_name'].find(display_name)
         if matching_players:
-            return matching_players[0]
+            return next(iter(matching_players))
         else:
             return None
 
+    def lowercase_display_names_in_use(self):
+        return self.player_indexes['display_name'].keys()
+
+    def index_player(self, player):
+        """ Must be called after a player's display name, login name or game server has changed """
+        if self.players.get(player.unique_id) is player:
+            for index in self.player_indexes.values():
+                index.update(player)
+
+    def unindex_player(self, player):
+        for index in self.player_indexes.values():
+            index.remove(player)
+
     def change_player_unique_id(self, old_id, new_id):
         if new_id in self.players:
             raise AlreadyLoggedInError()
@@ -165,6 +233,13 @@ class LoginServer:
         player = self.players.pop(old_id)
         player.unique_id = new_id
         self.players[new_id] = player
+        self.release_player_id(old_id)
+        self.index_player(player)
+
+    def release_player_id(self, unique_id):
+        # Verified players take their id from their account, only unverified ones are allocated here
+        if self.unverified_player_ids.in_range(unique_id):
+            self.unverified_player_ids.release(unique_id)
 
     def validate_username(self, username):
         if len(username) < Player.min_name_length:
@@ -243,7 +318,10 @@ class LoginServer:
 
     def handle_register_as_bot_message(self, msg):
         bot = msg.peer.authbot
+        if utils.AUTHBOT_ID in self.players:
+            self.unindex_player(self.players[utils.AUTHBOT_ID])
         self.players[utils.AUTHBOT_ID] = bot
+        self.index_player(bot)
         bot.friends.connect_to_social_network(self.social_network)
         bot.friends.notify_online()
 
@@ -259,9 +337,7 @@ class LoginServer:
 
     def handle_client_connected_message(self, msg):
         if isinstance(msg.peer, Player):
-            unique_id = utils.first_unused_number_above(self.players.keys(),
-                                                        utils.MIN_UNVERIFIED_ID,
-                                                        utils.MAX_UNVERIFIED_ID)
+            unique_id = self.unverified_player_ids.allocate()
 
             player = msg.peer
             player.friends.connect_to_social_network(self.social_network)
@@ -270,8 +346,9 @@ class LoginServer:
             player.complement_address_pair(self.address_pair)
             player.set_state(UnauthenticatedState)
             self.players[unique_id] = player
+            self.index_player(player)
         elif isinstance(msg.peer, GameServer):
-            server_id = utils.first_unused_number_above(self.all_game_servers().keys(), 1)
+            server_id = self.server_ids.allocate()
 
             game_server = msg.peer
             game_server.server_id = server_id
@@ -293,7 +370,9 @@ class LoginServer:
             player.disconnect()
             self.pending_callbacks.remove_receiver(player)
             player.set_state(OfflineState)
+            self.unindex_player(player)
             del(self.players[player.unique_id])
+            self.release_player_id(player.unique_id)
 
         elif isinstance(msg.peer, GameServer):
             game_server = msg.peer
@@ -301,6 +380,7 @@ class LoginServer:
             game_server.disconnect()
             self.pending_callbacks.remove_receiver(game_server)
             del (self.game_servers[game_server.server_id])
+            self.server_ids.release(game_server.server_id)
 
         elif isinstance(msg.peer, AuthCodeRequester):
             if utils.AUTHBOT_ID in self.players and self.players[utils.AUTHBOT_ID] == msg.peer.authbot:
@@ -315,8 +395,10 @@ class LoginServer:
         current_player.last_received_seq = msg.clientseq
 
         for request in msg.requests:
+            start_time = time.perf_counter()
             if not current_player.handle_request(request):
                 self.logger.info('%s sent: %04X' % (current_player, request.ident))
+            self.loop_stats.record_part('request %04X' % request.ident, time.perf_counter() - start_time)
 
         # This output is mostly for debugging of the incorrect number of players/servers online
         current_time = datetime.datetime.utcnow()
@@ -378,6 +460,12 @@ class LoginServer:
                     }, sort_keys=True, indent=4))
             else:
                 msg.peer.send_response(None)
+        elif msg.env['PATH_INFO'] == '/loop_stats':
+            loop_stats = self.loop_stats.to_dict()
+            loop_stats['connection_writers'] = dict(connection_writer_counters)
+            loop_stats['outgoing_queues'] = dict(peer_queue_counters)
+            loop_stats['presence_notifications'] = self.social_network.notification_stats()
+            msg.peer.send_response(json.dumps(loop_stats, sort_keys=True, indent=4))
         else:
             msg.peer.send_response(None)
 
@@ -481,7 +569,7 @@ class LoginServer:
 
     def handle_map_info_message(self, msg):
         game_server = msg.peer
-        game_server.map_id = msg.map_id
+        game_server.set_map_id(msg.map_id)
 
     def handle_team_info_message(self, msg):
         game_server = msg.peer
@@ -496,8 +584,7 @@ class LoginServer:
 
     def handle_score_info_message(self, msg):
         game_server = msg.peer
-        game_server.be_score = msg.be_score
-        game_server.ds_score = msg.ds_score
+        game_server.set_score(msg.be_score, msg.ds_score)
 
     def handle_match_time_message(self, msg):
         game_server = msg.peer
@@ -513,6 +600,15 @@ class LoginServer:
     def handle_match_end_message(self, msg):
         game_server = msg.peer
         server_uptime = int((datetime.datetime.utcnow() - game_server.start_time).total_seconds())
+        # Only the XP differs between players
+        xp_update_template = enumblockarraytemplate(a006d().set([
+            m04cb(),
+            m05dc(),
+            m03ce().set(0x434D0000),
+            m00fe().set([]),
+            m0632(),
+            m0296(),
+        ]), (m05dc,))
         for player in game_server.players.values():
             if str(player.unique_id) in msg.players_time_played:
                 time_played = msg.players_time_played[str(player.unique_id)]['time']
@@ -524,14 +620,7 @@ class LoginServer:
                 player.player_settings.progression.earn_xp(time_played, was_win)
 
                 # Update the XP in the UI
-                player.send(a006d().set([
-                    m04cb(),
-                    m05dc().set(player.player_settings.progression.rank_xp),
-                    m03ce().set(0x434D0000),
-                    m00fe().set([]),
-                    m0632(),
-                    m0296(),
-                ]))
+                player.send(xp_update_template.fill([m05dc().set(player.player_settings.progression.rank_xp)]))
         self.logger.info(f'{game_server}: match ended')
         game_server.initialize_map_vote(msg.next_map_idx, msg.votable_maps)
 
@@ -30,6 +30,7 @@ import os
 import sys
 
 from common.geventwrapper import gevent_spawn
+from common.lanequeue import PriorityLaneQueue
 from common.logging import set_up_logging
 from common.migration_mechanism import run_migrations
 from common.ports import Ports
@@ -40,7 +41,8 @@ from .gameserverlauncherhandler import handle_game_server_launcher
 from .gameclienthandler import handle_game_client
 from .httphandler import handle_http
 from .trafficdumper import TrafficDumper, dumpfilename
-from .loginserver import LoginServer
+from .loginserver import LoginServer, SERVER_QUEUE_LANES, server_queue_lane
+from .social_network import DEFAULT_FRIEND_LIST_THRESHOLD
 from .webhookhandler import handle_webhook
 
 
@@ -51,8 +53,10 @@ def handle_dump(dumpqueue):
         traffic_dumper.run()
 
 
-def handle_server(server_queue, client_queues, server_stats_queue, ports, accounts, shared_config, account_verification_enabled):
-    server = LoginServer(server_queue, client_queues, server_stats_queue, ports, accounts, shared_config, account_verification_enabled)
+def handle_server(server_queue, client_queues, server_stats_queue, ports, accounts, shared_config, account_verification_enabled,
+                  friend_list_threshold):
+    server = LoginServer(server_queue, client_queues, server_stats_queue, ports, accounts, shared_config, account_verification_enabled,
+                         friend_list_threshold)
     # server.trace_as('loginserver')
     server.run()
 
@@ -84,7 +88,7 @@ def main():
         sys.exit(2)
     
     client_queues = {}
-    server_queue = gevent.queue.Queue(maxsize=100)
+    server_queue = PriorityLaneQueue(SERVER_QUEUE_LANES, server_queue_lane)
     server_stats_queue = gevent.queue.Queue()
     dump_queue = gevent.queue.Queue() if args.dump else None
 
@@ -106,7 +110,8 @@ def main():
                      ports,
                      accounts,
                      config['shared'],
-                     config['loginserver']['account_verification'] == 'on'),
+                     config['loginserver']['account_verification'] == 'on',
+                     config['loginserver'].getint('friend_list_threshold', DEFAULT_FRIEND_LIST_THRESHOLD)),
         gevent_spawn("login server's handle_webhook",
                      handle_webhook,
                      server_stats_queue,
@@ -117,7 +122,9 @@ def main():
                      ports),
         gevent_spawn("login server's handle_game_client",
                      handle_game_client,
-                     server_queue, dump_queue, data_root),
+                     server_queue, dump_queue, data_root,
+                     config['loginserver'].get('client_write_coalescing', 'on') == 'on',
+                     config['loginserver'].getfloat('client_write_coalesce_delay', 0)),
         gevent_spawn("login server's handle_game_server_launcher",
                      handle_game_server_launcher,
                      server_queue,
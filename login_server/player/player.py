@@ -27,7 +27,8 @@ from ipaddress import IPv4Address
 from .friends import Friends
 from .loadouts import Loadouts
 from .settings import PlayerSettings
-from common.connectionhandler import Peer
+from common.connectionhandler import Peer, PeerQueue
+from common.datatypes import a0070, a011b, encodedfragment
 from common.ipaddresspair import IPAddressPair
 from common.statetracer import statetracer, RefOnly
 from common.game_items import get_game_setting_modes, UNMODDED_GAME_SETTING_MODE
@@ -41,6 +42,12 @@ class Player(Peer):
     max_name_length = 15
     idle_timeout = 60
 
+    # Chat and friend status updates can be left out for a client that
+    # doesn't keep up, anything else makes it get disconnected
+    outgoing_queue_policy = PeerQueue.POLICY_DROP_OLDEST
+    droppable_message_types = (a0070, a011b)
+    droppable_message_idents = frozenset(message_type().ident for message_type in droppable_message_types)
+
     def __init__(self, address, data_root):
         super().__init__()
 
@@ -131,6 +138,13 @@ class Player(Peer):
     def send(self, data):
         super().send((data, self.last_received_seq))
 
+    def is_droppable_message(self, msg):
+        data, _ = msg
+        if type(data) is encodedfragment:
+            # Broadcasts are sent to every player already encoded
+            return data.ident in self.droppable_message_idents
+        return type(data) in self.droppable_message_types
+
     def __repr__(self):
         return '%s(%s, %s:%s, %d:"%s")' % (self.task_name, self.task_id,
                                            self.address_pair, self.port,
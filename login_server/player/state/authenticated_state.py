@@ -30,6 +30,74 @@ from .player_state import PlayerState, handles, handles_control_message
 from common import utils
 
 
+def _build_menu_fragments(class_menu_data):
+    menu_fragments = {
+        PURCHASE_TYPE_SERVER: originalfragment(0x38d17, 0x3d0fe),
+        0x01ed: a0177().setdata(0x01ed, class_menu_data.class_purchases, False),  # Classes
+        0x01f0: a0177().setdata(0x01f0, {item
+                                         for _, class_items
+                                         in class_menu_data.class_items.items()
+                                         for item
+                                         in class_items.weapons},
+                                False),  # Weapons with categories
+        0x01f1: originalfragment(0x54bc6, 0x54db0),  # Purpose not fully known, needed or weapons are locked
+        0x01f2: a0177().setdata(0x01f2, {item
+                                         for _, class_items
+                                         in class_menu_data.class_items.items()
+                                         for item
+                                         in class_items.belt_items},
+                                False),  # Belt items
+        0x01f3: a0177().setdata(0x01f3, {item
+                                         for _, class_items
+                                         in class_menu_data.class_items.items()
+                                         for item
+                                         in class_items.packs},
+                                False),  # Packs
+        0x01f4: originalfragment(0x5a776, 0x6fde3),  # Item upgrades
+        # 0x01f6: originalfragment(0x5965a, 0x5a72b),  # Perks
+        0x01f6: a0177().setdata(0x01f6, {item
+                                         for item
+                                         in class_menu_data.perks},
+                                False),  # Perks
+        0x01f7: originalfragment(0x5a733, 0x5a76e),
+        0x01f8: originalfragment(0x5737d, 0x579af),  # Armor Upgrades
+        0x01f9: a0177().setdata(0x01f9, {item
+                                         for _, class_items
+                                         in class_menu_data.class_items.items()
+                                         for item
+                                         in class_items.skins},
+                                False),  # Skins
+        0x01fa: originalfragment(0x221a6, 0x22723),
+        0x01fb: originalfragment(0x2272b, 0x235b8),
+        PURCHASE_TYPE_BOOSTERS: originalfragment(0x235c0, 0x239dd),
+        PURCHASE_TYPE_NAME: originalfragment(0x239e5, 0x23acf),  # Name change
+        0x0206: originalfragment(0x2620e, 0x28ac1),
+        0x0214: originalfragment(0x23ad7, 0x26206),  # Purchaseable loadouts
+        0x0218: originalfragment(0x28ac9, 0x2f4d7),
+        # Weapon name <-> ID mapping - Probably only need to construct this at some point if we wanted to add entirely new weapons
+        0x021b: originalfragment(0x3d106, 0x47586),
+        0x021c: originalfragment(0x6fdeb, 0x6fecf),
+        0x0220: a0177().setdata(0x0220, {item
+                                         for item
+                                         in class_menu_data.voices},
+                                False),  # Voices
+        PURCHASE_TYPE_TAG: originalfragment(0x2f4df, 0x2f69f),  # Modify Clantag
+        0x0227: originalfragment(0x2f6a7, 0x38d0f),  # GOTY
+    }
+    # The sections that are built from the menu data are encoded right away
+    return {menu_part: fragment if isinstance(fragment, originalfragment) else encodedfragment.from_message(fragment)
+            for menu_part, fragment in menu_fragments.items()}
+
+
+# Encoded store menu sections per class menu data object. There is one such
+# object per game setting mode, built when common.game_items is imported.
+_menu_fragments_cache = utils.IdentityCache(_build_menu_fragments, maxsize=8)
+
+
+def get_menu_fragments(class_menu_data):
+    return _menu_fragments_cache.get(class_menu_data)
+
+
 class AuthenticatedState(PlayerState):
 
     @handles(packet=a0033)
@@ -48,10 +116,11 @@ class AuthenticatedState(PlayerState):
         if request.findbytype(m0228).value == 1:
             self.player.send(originalfragment(0x1EEB3, 0x20A10))  # 00d5 (map list)
         else:
-            self.player.send(a00d5().setservers(self.player.login_server
-                                                .all_game_servers()
-                                                .values(),
-                                                self.player.address_pair))  # 00d5 (server list)
+            self.player.send(a00d5().setserverrows(
+                game_server.get_server_list_row(self.player.address_pair)
+                for game_server in self.player.login_server.all_game_servers().values()
+                if game_server.joinable
+            ))  # 00d5 (server list)
 
     @handles(packet=a0014)
     def handle_a0014(self, request):
@@ -72,59 +141,7 @@ class AuthenticatedState(PlayerState):
     @handles(packet=a0177)
     def handle_menu(self, request):
         menu_part = request.findbytype(m02ab).value
-        menu_fragments = {
-            PURCHASE_TYPE_SERVER: originalfragment(0x38d17, 0x3d0fe),
-            0x01ed: a0177().setdata(0x01ed, get_unmodded_class_menu_data().class_purchases, False),  # Classes
-            0x01f0: a0177().setdata(0x01f0, {item
-                                             for _, class_items
-                                             in get_unmodded_class_menu_data().class_items.items()
-                                             for item
-                                             in class_items.weapons},
-                                    False),  # Weapons with categories
-            0x01f1: originalfragment(0x54bc6, 0x54db0),  # Purpose not fully known, needed or weapons are locked
-            0x01f2: a0177().setdata(0x01f2, {item
-                                             for _, class_items
-                                             in get_unmodded_class_menu_data().class_items.items()
-                                             for item
-                                             in class_items.belt_items},
-                                    False),  # Belt items
-            0x01f3: a0177().setdata(0x01f3, {item
-                                             for _, class_items
-                                             in get_unmodded_class_menu_data().class_items.items()
-                                             for item
-                                             in class_items.packs},
-                                    False),  # Packs
-            0x01f4: originalfragment(0x5a776, 0x6fde3),  # Item upgrades
-            # 0x01f6: originalfragment(0x5965a, 0x5a72b),  # Perks
-            0x01f6: a0177().setdata(0x01f6, {item
-                                             for item
-                                             in get_unmodded_class_menu_data().perks},
-                                    False),  # Perks
-            0x01f7: originalfragment(0x5a733, 0x5a76e),
-            0x01f8: originalfragment(0x5737d, 0x579af),  # Armor Upgrades
-            0x01f9: a0177().setdata(0x01f9, {item
-                                             for _, class_items
-                                             in get_unmodded_class_menu_data().class_items.items()
-                                             for item
-                                             in class_items.skins},
-                                    False),  # Skins
-            0x01fa: originalfragment(0x221a6, 0x22723),
-            0x01fb: originalfragment(0x2272b, 0x235b8),
-            PURCHASE_TYPE_BOOSTERS: originalfragment(0x235c0, 0x239dd),
-            PURCHASE_TYPE_NAME: originalfragment(0x239e5, 0x23acf),  # Name change
-            0x0206: originalfragment(0x2620e, 0x28ac1),
-            0x0214: originalfragment(0x23ad7, 0x26206),  # Purchaseable loadouts
-            0x0218: originalfragment(0x28ac9, 0x2f4d7),
-            # Weapon name <-> ID mapping - Probably only need to construct this at some point if we wanted to add entirely new weapons
-            0x021b: originalfragment(0x3d106, 0x47586),
-            0x021c: originalfragment(0x6fdeb, 0x6fecf),
-            0x0220: a0177().setdata(0x0220, {item
-                                             for item
-                                             in get_unmodded_class_menu_data().voices},
-                                    False),  # Voices
-            PURCHASE_TYPE_TAG: originalfragment(0x2f4df, 0x2f69f),  # Modify Clantag
-            0x0227: originalfragment(0x2f6a7, 0x38d0f),  # GOTY
-        }
+        menu_fragments = get_menu_fragments(get_unmodded_class_menu_data())
         if menu_part in menu_fragments:
             self.player.send(menu_fragments[menu_part])
         return True
@@ -34,6 +34,7 @@ class OnGameServerState(AuthenticatedState):
     def on_enter(self):
         self.logger.info("%s is entering state %s" % (self.player, type(self).__name__))
         self.player.game_server = self.game_server
+        self.player.login_server.index_player(self.player)
         self.player.game_server.add_player(self.player)
         self.player.game_server.set_player_loadouts(self.player)
         self.player.team = None
@@ -45,6 +46,7 @@ class OnGameServerState(AuthenticatedState):
         self.player.game_server.remove_player_loadouts(self.player)
         self.player.game_server.remove_player(self.player)
         self.player.game_server = None
+        self.player.login_server.index_player(self.player)
         self.player.team = None
         self.player.login_server.send_server_stats()
 
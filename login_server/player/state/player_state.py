@@ -19,83 +19,34 @@
 # along with taserver.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import inspect
 import logging
-from functools import wraps
 
 from common.datatypes import *
 from common.messages import Message
+from common.packethandlers import HandlerRegistry, handles, handles_control_message
 from ..player import Player
 
 
-def handles(packet):
-    """
-    A decorator that defines a function as a handler for a certain packet
-    :param packet: the packet being handled by the function
-    """
-
-    def real_decorator(func):
-        func.handles_packet = packet
-
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            return func(*args, **kwargs)
-
-        return wrapper
-
-    return real_decorator
-
-
-def handles_control_message(messageType):
-    """
-    A decorator that defines a function as a handler for a certain control message
-    sent by the player to the login server
-    :param messageType: the type of control message this function handles
-    """
-
-    def real_decorator(func):
-        func.handles_message = messageType
-
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            return func(*args, **kwargs)
-        return wrapper
-
-    return real_decorator
-
-
-class PlayerState:
+class PlayerState(HandlerRegistry):
     def __init__(self, player: Player):
         self.logger = logging.getLogger(__name__)
         self.player = player
 
     def handle_request(self, request):
-        methods = [
-            func for name, func in inspect.getmembers(self) if
-            getattr(func, 'handles_packet', None) == type(request)
-        ]
-        if not methods:
+        handler = self.packet_handlers.get(type(request))
+        if handler is None:
             self.logger.warning("No handler found for request %s" % request)
             return False
 
-        if len(methods) > 1:
-            raise ValueError("Duplicate handlers found for request")
-
-        return methods[0](request)
+        return handler(self, request)
 
     def handle_control_message(self, message: Message):
-        methods = [
-            func for name, func in inspect.getmembers(self) if
-            getattr(func, 'handles_message', None) == type(message)
-        ]
-        if not methods:
+        handler = self.control_message_handlers.get(type(message))
+        if handler is None:
             self.logger.warning("No handler found for control message %s" % str(message))
             return
 
-        if len(methods) > 1:
-            raise ValueError("Duplicate handlers found for control message")
-
-        methods[0](message)
+        handler(self, message)
 
     @handles(packet=a01c8)
     def handle_ping(self, request):
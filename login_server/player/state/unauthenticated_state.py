@@ -25,14 +25,13 @@ from .authenticated_state import AuthenticatedState
 from ..state.player_state import PlayerState, handles
 
 
-def choose_display_name(login_name, verified, names_in_use, max_name_length):
+def choose_display_name(login_name, verified, lowercase_names_in_use, max_name_length):
     if verified:
         display_name = login_name[:max_name_length]
     else:
         prefix = 'unvrf-'
         display_name = prefix + login_name[:max_name_length - len(prefix)]
         index = 2
-        lowercase_names_in_use = [name.lower() for name in names_in_use]
         while display_name.lower() in lowercase_names_in_use:
             display_name = 'unv%02d-%s' % (index, login_name[:max_name_length - len(prefix)])
             index += 1
@@ -65,6 +64,7 @@ class UnauthenticatedState(PlayerState):
             # be the one displayed. For account data, the login name is always lowercase
             original_login_name = request.findbytype(m0494).value
             self.player.login_name = original_login_name.lower()
+            self.player.login_server.index_player(self.player)
             self.player.password_hash = request.findbytype(m0056).content
             accounts = self.player.login_server.accounts
 
@@ -126,16 +126,16 @@ class UnauthenticatedState(PlayerState):
                                       self.player.login_server.players[new_unique_id].address_pair))
 
                 else:
-                    names_in_use = [p.display_name for p in self.player.login_server.players.values()
-                                    if p.display_name is not None]
+                    names_in_use = self.player.login_server.lowercase_display_names_in_use()
                     self.player.display_name = choose_display_name(original_login_name,
                                                                    self.player.verified,
                                                                    names_in_use,
                                                                    self.player.max_name_length)
+                    self.player.login_server.index_player(self.player)
                     self.player.load()
                     self.player.send([
-                        a003d().set_menu_data(get_unmodded_class_menu_data())
-                               .set_player(self.player),
+                        a003d.template(get_unmodded_class_menu_data())
+                             .fill(a003d.player_fields(self.player)),
                         m0662().set_original_bytes(0x8898, 0xdaff),
                         m0633().set_original_bytes(0xdaff, 0x19116),
                         m063e().set_original_bytes(0x19116, 0x1c6ee),
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+class PlayerIndex:
+    """
+    Keeps track of which players have a certain value for one of their
+    attributes, so that players can be looked up by that value without
+    going through all of them.
+
+    The index does not notice by itself when the attribute of a player
+    changes. Whoever changes it must call update() afterwards.
+    """
+    def __init__(self, attribute, key_func=None):
+        self.attribute = attribute
+        self.key_func = key_func
+        self.players_by_key = {}
+        self.keys_by_player = {}
+
+    def _key(self, value):
+        if value is None or self.key_func is None:
+            return value
+        return self.key_func(value)
+
+    def update(self, player):
+        key = self._key(getattr(player, self.attribute))
+        if player in self.keys_by_player:
+            if self.keys_by_player[player] == key:
+                return
+            self.remove(player)
+
+        if key is not None:
+            self.players_by_key.setdefault(key, set()).add(player)
+            self.keys_by_player[player] = key
+
+    def remove(self, player):
+        key = self.keys_by_player.pop(player, None)
+        if key is not None:
+            players = self.players_by_key[key]
+            players.discard(player)
+            if not players:
+                del self.players_by_key[key]
+
+    def find(self, value):
+        """ Returns the set of players whose attribute matches value; do not modify it """
+        return self.players_by_key.get(self._key(value), set())
+
+    def keys(self):
+        return self.players_by_key.keys()
@@ -27,25 +27,51 @@ SOCIAL_BITMASK_IN_LOBBY  = 0x00001000
 SOCIAL_BITMASK_IN_GAME   = 0x00003000
 
 import collections
+import logging
 
 from common.datatypes import *
 
+# A friend list message holds an entry for every friend and follower, so it
+# only pays off over separate notifications when many of them changed at once
+DEFAULT_FRIEND_LIST_THRESHOLD = 10
 
-class SocialNetwork:
 
-    def __init__(self):
+class SocialNetwork:
+    """
+    Keeps track of who is friends with whom and tells players about changes
+    in the presence of their friends and followers.
+
+    Presence notifications are not sent right away, but collected per
+    receiver until flush_notifications is called, which the login server
+    does after handling each message. Multiple changes of the same sender
+    then result in only one notification with its latest state, and a
+    receiver with more pending notifications than friend_list_threshold
+    gets a single refreshed friend list instead.
+    """
+
+    def __init__(self, friend_list_threshold=DEFAULT_FRIEND_LIST_THRESHOLD):
+        self.logger = logging.getLogger(__name__)
+        self.friend_list_threshold = friend_list_threshold
+        self.pending_notifications = {}
+        self.pending_notification_count = 0
+        self.notifications_requested = 0
+        self.notification_messages_sent = 0
+        self.friend_lists_sent = 0
         self.players = {}
         self.player_names = {}
         self.player_states = collections.defaultdict(lambda: SOCIAL_BITMASK_OFFLINE)
         self.player_friends = collections.defaultdict(set)
+        self.player_followers = collections.defaultdict(set)
 
     def add_friend(self, player_id, friend_id):
         self.player_friends[player_id].add(friend_id)
+        self.player_followers[friend_id].add(player_id)
         self._notify_specific_player(friend_id, player_id)
         self._notify_specific_player(player_id, friend_id)
 
     def remove_friend(self, player_id, friend_id):
         self.player_friends[player_id].remove(friend_id)
+        self.player_followers[friend_id].discard(player_id)
         self._notify_specific_player(friend_id, player_id)
         self._notify_specific_player(player_id, friend_id)
 
@@ -56,7 +82,7 @@ class SocialNetwork:
         self.player_states[player.unique_id] = SOCIAL_BITMASK_IN_LOBBY
         self.player_names[player.unique_id] = player.login_name
         self.player_names.update(friends)
-        self.player_friends[player.unique_id] = set(friends.keys())
+        self._set_friends(player.unique_id, set(friends.keys()))
 
         self._notify_followers_and_friends(player.unique_id, vice_versa=True)
 
@@ -69,12 +95,19 @@ class SocialNetwork:
         self._notify_followers_and_friends(player.unique_id)
         del self.players[player.unique_id]
 
+    def _set_friends(self, player_id, friends):
+        old_friends = self.player_friends[player_id]
+        for friend_id in old_friends - friends:
+            self.player_followers[friend_id].discard(player_id)
+        for friend_id in friends - old_friends:
+            self.player_followers[friend_id].add(player_id)
+        self.player_friends[player_id] = friends
+
     def _get_friends(self, player_id):
         return self.player_friends[player_id]
 
     def _get_followers(self, selected_player_id):
-        return {player_id for player_id, friends in
-                self.player_friends.items() if selected_player_id in friends}
+        return self.player_followers[selected_player_id]
 
     def _get_notification_type(self, sender_id, receiver_id):
         notification_type = self.player_states[sender_id]
@@ -95,15 +128,63 @@ class SocialNetwork:
 
     def _notify_specific_player(self, sender_id, receiver_id):
         if receiver_id in self.players:
-            notification_type = self._get_notification_type(sender_id, receiver_id)
-
-            msg = a011b().set([
-                m034a().set(self.player_names[sender_id]),
-                m020d().set(sender_id),
-                m0296(),
-                m0591().set(notification_type)
-            ])
-            self.players[receiver_id].send(msg)
+            self.pending_notification_count += 1
+            self.pending_notifications.setdefault(receiver_id, {})[sender_id] = None
+
+    def flush_notifications(self):
+        if not self.pending_notifications:
+            return
+
+        pending_notifications = self.pending_notifications
+        notification_count = self.pending_notification_count
+        self.pending_notifications = {}
+        self.pending_notification_count = 0
+        messages_sent = 0
+
+        for receiver_id, sender_ids in pending_notifications.items():
+            if receiver_id not in self.players:
+                continue
+
+            # Senders that are no longer in the receiver's friend list must still
+            # be notified separately to let the receiver know they are gone
+            if len(sender_ids) > self.friend_list_threshold:
+                listed_ids = self._get_followers(receiver_id) | self._get_friends(receiver_id)
+                sender_ids = [sender_id for sender_id in sender_ids if sender_id not in listed_ids]
+                self.send_friend_list(receiver_id)
+                self.friend_lists_sent += 1
+                messages_sent += 1
+
+            for sender_id in sender_ids:
+                self._send_notification(sender_id, receiver_id)
+                messages_sent += 1
+
+        self.notifications_requested += notification_count
+        self.notification_messages_sent += messages_sent
+        self.logger.debug('sent %d presence messages for %d notifications (%d saved in total)' %
+                          (messages_sent, notification_count, self.messages_saved()))
+
+    def messages_saved(self):
+        return self.notifications_requested - self.notification_messages_sent
+
+    def notification_stats(self):
+        return {
+            'friend_list_threshold': self.friend_list_threshold,
+            'notifications_requested': self.notifications_requested,
+            'messages_sent': self.notification_messages_sent,
+            'friend_lists_sent': self.friend_lists_sent,
+            'messages_saved': self.messages_saved(),
+        }
+
+    def _send_notification(self, sender_id, receiver_id):
+        notification_type = self._get_notification_type(sender_id, receiver_id)
+
+        msg = a011b().set([
+            m034a().set(self.player_names[sender_id]),
+            m020d().set(sender_id),
+            m0296(),
+            m0591().set(notification_type)
+        ])
+        self.players[receiver_id].send(msg)
 
     def send_friend_list(self, player_id):
         followers = self._get_followers(player_id)
@@ -453,7 +453,7 @@ def carrays2indentandbytesperblock(hexdumpfile: TextIO) -> Generator[Tuple[bool,
     lastlineofpacket = False
     peer = None
 
-    for linenum, line in enumerate(infile):
+    for linenum, line in enumerate(hexdumpfile):
         line = line.strip()
 
         if not line:
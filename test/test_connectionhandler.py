@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+
+import gevent
+import gevent.queue
+from gevent import socket
+
+from common.connectionhandler import Peer, PeerDisconnectedMessage, PeerQueue, TcpMessageConnectionWriter, \
+    connection_writer_counters
+from common.loginprotocol import LoginProtocolWriter
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def sendmsg(self, buffers):
+        data = b''.join(buffers)
+        self.sent.append(data)
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+
+class BytesWriter(TcpMessageConnectionWriter):
+    def encode(self, msg):
+        return msg
+
+
+class CoalescingWriterTestCase(unittest.TestCase):
+    def run_writer(self, msgs, **kwargs):
+        sock = RecordingSocket()
+        writer = BytesWriter(sock, coalesce=True, **kwargs)
+        writer.outgoing_queue = gevent.queue.Queue()
+        for msg in msgs:
+            writer.outgoing_queue.put(msg)
+        writer.outgoing_queue.put(PeerDisconnectedMessage(None))
+        writer.run()
+        return sock, writer
+
+    def test_queued_messages_are_sent_together(self):
+        sock, writer = self.run_writer([b'first', b'second', b'third'])
+        self.assertEqual(sock.sent, [b'\x05\x00first\x06\x00second\x05\x00third'])
+        self.assertEqual((writer.messages_sent, writer.sends, writer.bytes_sent), (3, 1, 16))
+        self.assertTrue(sock.closed)
+
+    def test_byte_budget_limits_what_is_sent_together(self):
+        sock, writer = self.run_writer([b'a' * 10] * 5, coalesce_max_bytes=20)
+        self.assertEqual([len(data) for data in sock.sent], [24, 24, 12])
+        self.assertEqual((writer.messages_sent, writer.sends), (5, 3))
+
+    def test_login_protocol_writer_takes_coalescing_settings(self):
+        writer = LoginProtocolWriter(RecordingSocket(), None, coalesce=False, coalesce_delay=0.01)
+        self.assertEqual((writer.coalesce, writer.coalesce_delay), (False, 0.01))
+        self.assertTrue(LoginProtocolWriter(RecordingSocket(), None).coalesce)
+
+    def test_totals_are_kept_while_running(self):
+        before = connection_writer_counters.copy()
+        self.run_writer([b'first', b'second'])
+        self.assertEqual(connection_writer_counters['messages'] - before['messages'], 2)
+        self.assertEqual(connection_writer_counters['sends'] - before['sends'], 1)
+
+    def test_disconnect_with_exception_is_raised_after_sending(self):
+        sock = RecordingSocket()
+        writer = BytesWriter(sock, coalesce=True)
+        writer.outgoing_queue = gevent.queue.Queue()
+        writer.outgoing_queue.put(b'last words')
+        writer.outgoing_queue.put(PeerDisconnectedMessage(None, RuntimeError('kicked')))
+        with self.assertRaises(RuntimeError):
+            writer.run()
+        self.assertEqual(sock.sent, [b'\x0a\x00last words'])
+        self.assertTrue(sock.closed)
+
+
+class QueuePeer(Peer):
+    estimated_message_size = 100
+
+    def is_droppable_message(self, msg):
+        return msg.startswith('droppable')
+
+
+class PeerQueueTestCase(unittest.TestCase):
+    def create_queue(self, policy, **kwargs):
+        queue = PeerQueue(QueuePeer(), maxsize=2, policy=policy, **kwargs)
+        return queue
+
+    def contents(self, queue):
+        return [type(item).__name__ if isinstance(item, PeerDisconnectedMessage) else item for item in queue.queue]
+
+    def test_drop_oldest_drops_oldest_droppable_message(self):
+        queue = self.create_queue(PeerQueue.POLICY_DROP_OLDEST)
+        for msg in ('important', 'droppable 1', 'droppable 2'):
+            queue.put(msg)
+        self.assertEqual(self.contents(queue), ['important', 'droppable 2'])
+        self.assertEqual(queue.counters['dropped'], 1)
+
+    def test_drop_oldest_disconnects_when_nothing_can_be_dropped(self):
+        queue = self.create_queue(PeerQueue.POLICY_DROP_OLDEST)
+        for msg in ('important 1', 'important 2', 'important 3', 'important 4'):
+            queue.put(msg)
+        self.assertEqual(self.contents(queue), ['important 1', 'important 2', 'PeerDisconnectedMessage'])
+        self.assertEqual(queue.counters['overflow_disconnects'], 1)
+        self.assertEqual(queue.counters['dropped_after_disconnect'], 1)
+
+    def test_disconnect_policy_disconnects_on_overflow(self):
+        queue = self.create_queue(PeerQueue.POLICY_DISCONNECT)
+        for msg in ('droppable 1', 'droppable 2', 'droppable 3'):
+            queue.put(msg)
+        self.assertEqual(self.contents(queue), ['droppable 1', 'droppable 2', 'PeerDisconnectedMessage'])
+
+    def test_spill_grows_until_byte_budget_is_used_up(self):
+        queue = self.create_queue(PeerQueue.POLICY_SPILL, spill_max_bytes=400)
+        for i in range(6):
+            queue.put('message %d' % i)
+        self.assertEqual(self.contents(queue), ['message 0', 'message 1', 'message 2', 'message 3',
+                                                'PeerDisconnectedMessage'])
+        self.assertEqual(queue.counters['spilled'], 2)
+
+    def test_spilled_bytes_are_released_by_get(self):
+        queue = self.create_queue(PeerQueue.POLICY_SPILL, spill_max_bytes=300)
+        for i in range(3):
+            queue.put('message %d' % i)
+        queue.get()
+        queue.put('message 3')
+        self.assertEqual(self.contents(queue), ['message 1', 'message 2', 'message 3'])
+
+    def test_disconnect_gets_into_a_full_queue(self):
+        queue = self.create_queue(PeerQueue.POLICY_BLOCK)
+        queue.put('message 1')
+        queue.put('message 2')
+        queue.put(PeerDisconnectedMessage(None))
+        self.assertEqual(self.contents(queue), ['message 1', 'message 2', 'PeerDisconnectedMessage'])
+
+    def test_overflow_disconnect_unblocks_a_stalled_writer(self):
+        sock, other_end = socket.socketpair()
+        self.addCleanup(other_end.close)
+        writer = BytesWriter(sock)
+        queue = self.create_queue(PeerQueue.POLICY_DISCONNECT, sock=sock)
+        writer.outgoing_queue = queue
+        writer_task = gevent.spawn(writer.run)
+
+        # Nobody reads from the other end, so the writer gets stuck in a send
+        while not writer_task.dead and not queue.full():
+            queue.put(b'x' * 0xFFF0)
+            gevent.sleep(0.01)
+        queue.put(b'one too many')
+
+        writer_task.join(timeout=5)
+        self.assertTrue(writer_task.dead)
+        self.assertTrue(queue.disconnected)
+        self.assertEqual(queue.counters['overflow_disconnects'], 1)
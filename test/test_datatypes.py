@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import io
+from ipaddress import IPv4Address
+import struct
+import unittest
+import unittest.mock
+
+from common import datatypes
+from common.datatypes import *
+from common.game_items import UNMODDED_GAME_SETTING_MODE, get_unmodded_class_menu_data
+from common.ipaddresspair import IPAddressPair
+from common.loginprotocol import PacketReader, StreamParser
+from login_server.player.loadouts import Loadouts
+from login_server.player.settings import PlayerSettings
+
+CAPTURE_FILE = 'resources/tribescapture.bin.stripped'
+
+
+def read_capture():
+    with open(CAPTURE_FILE, 'rb') as f:
+        return f.read()
+
+
+def parse_capture(data, chunk_size=1450):
+    """ Parse the capture the way a LoginProtocolReader would and return (start, end, seq, objs) per message """
+    chunks = iter([data[i:i + chunk_size] for i in range(0, len(data), chunk_size)])
+
+    def receive():
+        try:
+            return next(chunks)
+        except StopIteration:
+            raise EOFError
+
+    parser = StreamParser(PacketReader(receive))
+    messages = []
+    offset = 0
+    while offset < len(data):
+        seq, objs = parser.parse()
+        stream = io.BytesIO()
+        for obj in objs:
+            obj.write(stream)
+        end = offset + len(stream.getvalue()) + (8 if seq is not None else 0)
+        messages.append((offset, end, seq, objs))
+        offset = end
+    return messages
+
+
+class EnumfieldClassTableTestCase(unittest.TestCase):
+    def test_field_idents_map_to_their_classes(self):
+        self.assertIs(datatypes._enumfield_classes[0x0348], m0348)
+        self.assertIs(datatypes._enumfield_classes[0x00e9], m00e9)
+
+    def test_top_level_idents_prefer_message_classes(self):
+        self.assertIs(datatypes._top_level_enumfield_classes[0x003d], a003d)
+        self.assertIs(datatypes._top_level_enumfield_classes[0x0662], m0662)
+
+    def test_every_class_has_the_ident_of_its_name(self):
+        for ident, cls in datatypes._top_level_enumfield_classes.items():
+            self.assertEqual(cls().ident, ident, cls.__name__)
+
+    def test_unknown_ident_is_rejected(self):
+        stream = PacketReader(lambda: struct.pack('<HH', 0xfffe, 0))
+        with self.assertRaises(KeyError):
+            construct_top_level_enumfield(stream)
+
+
+class CaptureRoundTripTestCase(unittest.TestCase):
+    def test_reencoded_capture_matches_original_bytes(self):
+        data = read_capture()
+        for start, end, seq, objs in parse_capture(data):
+            stream = io.BytesIO()
+            for obj in objs:
+                obj.write(stream)
+            if seq is not None:
+                stream.write(struct.pack('<L', seq))
+                stream.write(data[end - 4:end])
+            self.assertEqual(stream.getvalue(), data[start:end], 'message at offset 0x%X' % start)
+
+
+class OriginalBytesTestCase(unittest.TestCase):
+    def test_fragments_are_served_from_memory(self):
+        data = read_capture()
+        stream = io.BytesIO()
+        originalfragment(0x1EEB3, 0x20A10).write(stream)
+
+        with unittest.mock.patch('builtins.open', side_effect=AssertionError('capture was read again')):
+            originalfragment(0x20B47, 0x20B4B).write(stream)
+
+        self.assertEqual(stream.getvalue(), data[0x1EEB3:0x20A10] + data[0x20B47:0x20B4B])
+
+
+class SharedFieldTestCase(unittest.TestCase):
+    def test_fields_have_no_instance_dict(self):
+        for field in (m0296(), m0013(), m0246(), m00e9(), a003d(), m0056()):
+            self.assertFalse(hasattr(field, '__dict__'), type(field).__name__)
+
+    def test_shared_instance_is_reused(self):
+        self.assertIs(m0296.shared(), m0296.shared())
+
+    def test_setting_a_shared_instance_raises(self):
+        shared = m0296.shared()
+        original_value = shared.value
+        with self.assertRaises(ValueError):
+            shared.set(original_value + 1)
+        with self.assertRaises(ValueError):
+            m0442.shared().set_success(False)
+        self.assertEqual(shared.value, original_value)
+
+    def test_findbytype_replaces_shared_instance_by_a_copy(self):
+        msg = a0070().set([m009e.shared(), m02e6.shared()])
+        msg.findbytype(m02e6).set('hello')
+        self.assertIsNot(msg.content[1], m02e6.shared())
+        self.assertEqual(msg.content[1].value, 'hello')
+        self.assertEqual(m02e6.shared().value, m02e6().value)
+
+
+class FixedLayoutTestCase(unittest.TestCase):
+    def test_fixed_layout_encodes_like_separate_fields(self):
+        fields = [m0348().set(1234), m0442().set_success(True), m0008().set(b'\x01\x02\x03\x04\x05\x06\x07\x08'),
+                  m02e6().set('hi'), m0296().set(7)]
+        expected = io.BytesIO()
+        for field in fields:
+            field.write(expected)
+        stream = io.BytesIO()
+        datatypes._write_fields(stream, fields)
+        self.assertEqual(stream.getvalue(), expected.getvalue())
+
+    def test_rows_with_the_same_layout_decode_through_it(self):
+        msg = m00e9().setservers([], None)
+        msg.arrays = [[m0348().set(i), m0296().set(i * 2)] for i in range(3)]
+        stream = io.BytesIO()
+        msg.write(stream)
+
+        decoded = construct_top_level_enumfield(PacketReader(lambda: stream.getvalue()))
+        self.assertEqual([[(type(f), f.value) for f in arr] for arr in decoded.arrays],
+                         [[(m0348, i), (m0296, i * 2)] for i in range(3)])
+
+
+class TemplatePlayer:
+    def __init__(self, unique_id, display_name, clan_tag, rank_xp):
+        self.unique_id = unique_id
+        self.display_name = display_name
+        self.player_settings = PlayerSettings()
+        self.player_settings.clan_tag = clan_tag
+        self.player_settings.progression.rank_xp = rank_xp
+        self.loadouts = Loadouts(UNMODDED_GAME_SETTING_MODE)
+
+    def get_unmodded_loadouts(self):
+        return self.loadouts
+
+
+class LoginReplyTemplateTestCase(unittest.TestCase):
+    def test_filled_template_matches_fully_encoded_reply(self):
+        menu_data = get_unmodded_class_menu_data()
+        for player in (TemplatePlayer(123, 'someone', '', 0), TemplatePlayer(0x10000000, 'other', 'TAG', 50000)):
+            expected = io.BytesIO()
+            a003d().set_menu_data(menu_data).set_player(player).write(expected)
+            actual = io.BytesIO()
+            a003d.template(menu_data).fill(a003d.player_fields(player)).write(actual)
+            self.assertEqual(actual.getvalue(), expected.getvalue())
+
+    def test_template_is_built_once_per_menu_data(self):
+        menu_data = get_unmodded_class_menu_data()
+        self.assertIs(a003d.template(menu_data), a003d.template(menu_data))
+
+
+class LazyDecodingTestCase(unittest.TestCase):
+    def encode(self, msg):
+        stream = io.BytesIO()
+        msg.write(stream)
+        return stream.getvalue()
+
+    def decode(self, data):
+        return construct_top_level_enumfield(PacketReader(lambda: data))
+
+    def test_unmodified_message_is_written_as_it_was_read(self):
+        data = self.encode(a0070().set([m009e().set(MESSAGE_PUBLIC), m02e6().set('hello'), m02fe().set('someone')]))
+        msg = self.decode(data)
+        self.assertIsInstance(msg._content[1], datatypes.rawfield)
+        self.assertEqual(self.encode(msg), data)
+
+    def test_findbytype_decodes_only_the_requested_field(self):
+        msg = self.decode(self.encode(a0070().set([m009e().set(MESSAGE_PUBLIC), m02e6().set('hello')])))
+        self.assertEqual(msg.findbytype(m02e6).value, 'hello')
+        self.assertIsInstance(msg._content[0], datatypes.rawfield)
+        self.assertIsInstance(msg._content[1], m02e6)
+
+    def test_modifications_are_written(self):
+        msg = self.decode(self.encode(a0070().set([m009e().set(MESSAGE_PRIVATE), m034a().set('someone')])))
+        msg.findbytype(m034a).set('other')
+        msg.content.append(m02fe().set('sender'))
+        expected = a0070().set([m009e().set(MESSAGE_PRIVATE), m034a().set('other'), m02fe().set('sender')])
+        self.assertEqual(self.encode(msg), self.encode(expected))
+
+    def test_nested_arrays_are_decoded_on_request(self):
+        pings = []
+        for region, ping in ((REGION_EUROPE, 45), (REGION_OCEANIA_AUSTRALIA, 300)):
+            ping_field = m053d()
+            ping_field.value = ping
+            pings.append([m0448().set(region), ping_field])
+        data = self.encode(a01c8().set([m068b().set(pings)]))
+        msg = self.decode(data)
+        self.assertEqual([(findbytype(arr, m0448).value, findbytype(arr, m053d).value)
+                          for arr in msg.findbytype(m068b).arrays],
+                         [(REGION_EUROPE, 45), (REGION_OCEANIA_AUSTRALIA, 300)])
+        self.assertEqual(self.encode(msg), data)
+
+    def test_nested_fields_with_their_own_read_are_decoded(self):
+        data = self.encode(a0070().set([m068b().set([[m0448().set(REGION_EUROPE), m0056().set(b'1' * 72)]])]))
+        msg = self.decode(data)
+        self.assertEqual(findbytype(msg.findbytype(m068b).arrays[0], m0056).content, b'1' * 72)
+        self.assertEqual(self.encode(msg), data)
+
+    def test_nested_fields_with_their_own_read_are_checked(self):
+        data = self.encode(a01c8().set([m068b().set([[m0056().set(b'1' * 10)]])]))
+        with self.assertRaises(ParseError):
+            self.decode(data)
+
+
+class FieldListTestCase(unittest.TestCase):
+    def test_findbytype_returns_first_field_of_type(self):
+        msg = a0070().set([m009e().set(MESSAGE_PUBLIC), m02e6().set('first'), m02e6().set('second')])
+        self.assertEqual(msg.findbytype(m02e6).value, 'first')
+        self.assertIsNone(msg.findbytype(m034a))
+
+    def test_appended_fields_can_be_found(self):
+        msg = a0070().set([m009e().set(MESSAGE_PUBLIC)])
+        self.assertIsNone(msg.findbytype(m02fe))
+        msg.content.append(m02fe().set('someone'))
+        msg.content.extend([m06de().set('TAG'), m02fe().set('other')])
+        self.assertEqual(msg.findbytype(m02fe).value, 'someone')
+        self.assertEqual(msg.findbytype(m06de).value, 'TAG')
+
+    def test_other_modifications_are_taken_into_account(self):
+        msg = a0070().set([m009e().set(MESSAGE_PUBLIC), m02e6().set('first')])
+        self.assertEqual(msg.findbytype(m02e6).value, 'first')
+        msg.content.insert(0, m02e6().set('inserted'))
+        self.assertEqual(msg.findbytype(m02e6).value, 'inserted')
+        del msg.content[0]
+        msg.content[1] = m034a().set('replaced')
+        self.assertIsNone(msg.findbytype(m02e6))
+        self.assertEqual(msg.findbytype(m034a).value, 'replaced')
+
+    def test_content_still_behaves_as_a_list(self):
+        fields = [m009e().set(MESSAGE_PUBLIC), m02e6().set('text')]
+        msg = a0070().set(fields)
+        self.assertEqual(msg.content, fields)
+        self.assertIsInstance(msg.content, list)
+
+
+class ServerListRowTestCase(unittest.TestCase):
+    class Server:
+        def __init__(self, server_id, password_hash):
+            self.server_id = server_id
+            self.joinable = True
+            self.players = {1: None, 2: None}
+            self.region = REGION_EUROPE
+            self.password_hash = password_hash
+            self.game_setting_mode = 'ootb'
+            self.description = 'server %d' % server_id
+            self.motd = 'welcome'
+            self.map_id = 1456
+            self.be_score = 3
+            self.ds_score = 2
+            self.address_pair = IPAddressPair(IPv4Address('80.100.0.%d' % server_id), IPv4Address('192.168.1.10'))
+            self.pingport = 9002
+            self.time_remaining = 600
+
+        def get_time_remaining(self):
+            return self.time_remaining
+
+    def encode(self, msg):
+        stream = io.BytesIO()
+        msg.write(stream)
+        return stream.getvalue()
+
+    def test_rows_encode_like_the_server_list(self):
+        servers = [self.Server(1, None), self.Server(2, b'hash')]
+        player_address = IPAddressPair(IPv4Address('80.101.0.1'), None)
+        rows = [serverlistrow(server, player_address) for server in servers]
+
+        servers[0].time_remaining = 123
+        expected = self.encode(a00d5().setservers(servers, player_address))
+        actual = self.encode(a00d5().setserverrows(row.fill(server.get_time_remaining())
+                                                   for row, server in zip(rows, servers)))
+        self.assertEqual(actual, expected)
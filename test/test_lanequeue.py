@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+
+import gevent
+import gevent.queue
+
+from common.lanequeue import PriorityLaneQueue
+
+
+def lane_of(item):
+    return item[0]
+
+
+class PriorityLaneQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.queue = PriorityLaneQueue([('control', 3, 5), ('clients', 1, 5)], lane_of)
+
+    def test_items_within_a_lane_keep_their_order(self):
+        for i in range(5):
+            self.queue.put(('clients', i))
+        self.assertEqual([self.queue.get()[1] for i in range(5)], [0, 1, 2, 3, 4])
+
+    def test_lanes_are_drained_in_proportion_to_their_weight(self):
+        for i in range(4):
+            self.queue.put(('clients', i))
+        for i in range(4):
+            self.queue.put(('control', i))
+        lanes = [self.queue.get()[0] for i in range(8)]
+        self.assertEqual(lanes[:4].count('control'), 3)
+        self.assertEqual(lanes[:4].count('clients'), 1)
+
+    def test_full_lane_does_not_block_other_lanes(self):
+        for i in range(5):
+            self.queue.put(('clients', i))
+        with self.assertRaises(gevent.queue.Full):
+            self.queue.put(('clients', 5), block=False)
+        self.queue.put(('control', 0), block=False)
+        self.assertEqual(self.queue.lane_sizes(), {'control': 1, 'clients': 5})
+
+    def test_get_on_empty_queue_raises_empty(self):
+        with self.assertRaises(gevent.queue.Empty):
+            self.queue.get(block=False)
+
+    def test_blocked_put_resumes_when_lane_has_room(self):
+        for i in range(5):
+            self.queue.put(('clients', i))
+        putter = gevent.spawn(self.queue.put, ('clients', 5))
+        gevent.sleep(0)
+        self.assertFalse(putter.dead)
+        self.queue.get()
+        putter.join(timeout=1)
+        self.assertTrue(putter.dead)
+        self.assertEqual(self.queue.qsize(), 5)
+
+    def test_wait_and_depth_are_recorded_on_get(self):
+        self.queue.put(('control', 0))
+        self.queue.put(('clients', 0))
+        self.queue.get()
+        self.assertGreater(self.queue.last_wait, 0.0)
+        self.assertEqual(self.queue.last_depth, 1)
+
@@ -22,7 +22,12 @@ from ipaddress import IPv4Address
 import unittest
 import unittest.mock as mock
 
+from common.datatypes import a0070, encodedfragment, m02e6
+from common.connectionhandler import PeerDisconnectedMessage
+from common.pendingcallbacks import ExecuteCallbackMessage
 from login_server.gameserver import GameServer
+from login_server.loginserver import server_queue_lane
+from login_server.player.player import Player
 
 
 class TestGameServer(GameServer):
@@ -65,3 +70,33 @@ class GameServerTestCase(unittest.TestCase):
         self.gameserver.map_votes = {}
         self.gameserver.process_map_votes()
         self.assertEqual(self.gameserver.msg.map_id, 2)
+
+    def _add_players(self, *names):
+        for unique_id, name in enumerate(names):
+            self.gameserver.players[unique_id] = mock.Mock(display_name=name, team=unique_id % 2)
+
+    def test_send_all_players__message_is_encoded_once_for_all_players(self):
+        self._add_players('person1', 'person2', 'person3')
+        self.gameserver.send_all_players(a0070().set([m02e6().set('hello')]))
+        fragments = [player.send.call_args[0][0] for player in self.gameserver.players.values()]
+        self.assertIs(type(fragments[0]), encodedfragment)
+        self.assertTrue(all(fragment is fragments[0] for fragment in fragments))
+
+    def test_send_public_message_from_server__each_player_gets_their_own_name(self):
+        self._add_players('person1', 'person2')
+        self.gameserver._send_public_message_from_server('hello')
+        for player in self.gameserver.players.values():
+            fragment = player.send.call_args[0][0]
+            self.assertEqual(fragment.ident, 0x0070)
+            self.assertIn(player.display_name.encode(), fragment.data)
+
+
+class ServerQueueLaneTestCase(unittest.TestCase):
+    def test_callbacks_of_a_player_stay_in_the_lane_of_its_disconnect(self):
+        player = mock.Mock(spec=Player)
+        self.assertEqual(server_queue_lane(ExecuteCallbackMessage(1, player)),
+                         server_queue_lane(PeerDisconnectedMessage(player)))
+
+    def test_other_callbacks_and_game_servers_have_lanes_of_their_own(self):
+        self.assertEqual(server_queue_lane(ExecuteCallbackMessage(1, mock.Mock(spec=GameServer))), 'timers')
+        self.assertEqual(server_queue_lane(PeerDisconnectedMessage(TestGameServer())), 'control')
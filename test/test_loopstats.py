@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+
+from common.loopstats import InstrumentedQueue, MessageLoopStats
+
+
+class InstrumentedQueueTestCase(unittest.TestCase):
+    def test_wait_and_depth_are_recorded_on_get(self):
+        queue = InstrumentedQueue(maxsize=10)
+        queue.put('first')
+        queue.put('second')
+        self.assertEqual(queue.get(), 'first')
+        self.assertGreater(queue.last_wait, 0.0)
+        self.assertEqual(queue.last_depth, 1)
+        self.assertEqual(queue.get(), 'second')
+        self.assertEqual(queue.last_depth, 0)
+
+
+class MessageLoopStatsTestCase(unittest.TestCase):
+    def test_messages_are_counted_per_type(self):
+        queue = InstrumentedQueue()
+        stats = MessageLoopStats('test')
+        queue.put('message')
+        queue.get()
+        stats.record_message('SomeMessage', 0.002, queue)
+        stats.record_message('SomeMessage', 2.0, queue)
+        stats.record_part('request 0070', 0.00005)
+
+        result = stats.to_dict()
+        self.assertEqual(result['messages']['SomeMessage']['count'], 2)
+        self.assertEqual(result['messages']['SomeMessage']['max_ms'], 2000.0)
+        self.assertEqual(result['messages']['SomeMessage']['histogram']['<10ms'], 1)
+        self.assertEqual(result['messages']['SomeMessage']['histogram']['>=1s'], 1)
+        self.assertEqual(result['parts']['request 0070']['histogram']['<0.1ms'], 1)
+        self.assertEqual(result['queue_depth']['max'], 0)
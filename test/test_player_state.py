@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+import unittest.mock as mock
+
+from common.datatypes import a0033, a003a, a01c8, m0056, m0494
+from common.messages import Client2LoginConnect
+from login_server.player.state.authenticated_state import AuthenticatedState
+from login_server.player.state.on_game_server_state import OnGameServerState
+from login_server.player.state.player_state import PlayerState, handles, handles_control_message
+from login_server.player.state.unauthenticated_state import UnauthenticatedState
+
+
+class HandlerTableTestCase(unittest.TestCase):
+    def test_handlers_are_inherited(self):
+        self.assertIs(OnGameServerState.packet_handlers[a0033], AuthenticatedState.handle_a0033)
+        self.assertIs(OnGameServerState.packet_handlers[a01c8], PlayerState.handle_ping)
+        self.assertIs(OnGameServerState.control_message_handlers[Client2LoginConnect],
+                      AuthenticatedState.handle_client2login_connect)
+
+    def test_overriding_a_handler_replaces_it(self):
+        class PingState(PlayerState):
+            @handles(packet=a01c8)
+            def handle_ping(self, request):
+                return 'overridden'
+
+        state = PingState.__new__(PingState)
+        self.assertEqual(state.handle_request(a01c8()), 'overridden')
+
+    def test_duplicate_handlers_are_rejected_at_class_definition(self):
+        with self.assertRaises(ValueError):
+            class DuplicateState(PlayerState):
+                @handles(packet=a01c8)
+                def handle_other_ping(self, request):
+                    pass
+
+        with self.assertRaises(ValueError):
+            class DuplicateControlState(PlayerState):
+                @handles_control_message(messageType=Client2LoginConnect)
+                def handle_connect(self, message):
+                    pass
+
+                @handles_control_message(messageType=Client2LoginConnect)
+                def handle_connect_again(self, message):
+                    pass
+
+
+class PlayerIndexingTestCase(unittest.TestCase):
+    def test_login_name_is_indexed_even_if_the_login_is_rejected(self):
+        player = mock.Mock()
+        player.login_server.validate_username.return_value = 'User name is too short'
+        state = UnauthenticatedState.__new__(UnauthenticatedState)
+        state.player = player
+        state.logger = mock.Mock()
+
+        state.handle_login_request(a003a().set([m0494().set('SomeName'), m0056().set(b'0' * 90)]))
+
+        self.assertEqual(player.login_name, 'somename')
+        player.login_server.index_player.assert_called_with(player)
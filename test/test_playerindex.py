@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+
+from login_server.playerindex import PlayerIndex
+
+
+class IndexedPlayer:
+    def __init__(self, display_name):
+        self.display_name = display_name
+
+
+class PlayerIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = PlayerIndex('display_name', key_func=str.lower)
+
+    def test_find_uses_key_func(self):
+        player = IndexedPlayer('SomePlayer')
+        self.index.update(player)
+        self.assertEqual(self.index.find('someplayer'), {player})
+        self.assertEqual(set(self.index.keys()), {'someplayer'})
+
+    def test_update_moves_player_to_new_key(self):
+        player = IndexedPlayer('first')
+        self.index.update(player)
+        player.display_name = 'second'
+        self.index.update(player)
+        self.assertEqual(self.index.find('first'), set())
+        self.assertEqual(self.index.find('second'), {player})
+
+    def test_players_with_none_are_not_indexed(self):
+        player = IndexedPlayer(None)
+        self.index.update(player)
+        self.assertEqual(len(self.index.keys()), 0)
+
+    def test_remove_keeps_other_players_with_same_key(self):
+        player1 = IndexedPlayer('name')
+        player2 = IndexedPlayer('NAME')
+        self.index.update(player1)
+        self.index.update(player2)
+        self.index.remove(player1)
+        self.assertEqual(self.index.find('name'), {player2})
+        self.index.remove(player2)
+        self.assertEqual(len(self.index.keys()), 0)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+
+from common.datatypes import a011b, a011c, m020d
+from login_server.social_network import SocialNetwork
+
+
+class SocialPlayer:
+    def __init__(self, unique_id):
+        self.unique_id = unique_id
+        self.login_name = 'player%d' % unique_id
+        self.verified = True
+        self.messages = []
+
+    def send(self, msg):
+        self.messages.append(msg)
+
+
+class FollowerMapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.social_network = SocialNetwork()
+
+    def test_followers_track_added_and_removed_friends(self):
+        self.social_network.add_friend(1, 2)
+        self.social_network.add_friend(3, 2)
+        self.assertEqual(self.social_network._get_followers(2), {1, 3})
+
+        self.social_network.remove_friend(1, 2)
+        self.assertEqual(self.social_network._get_followers(2), {3})
+
+    def test_followers_follow_friend_list_given_when_coming_online(self):
+        self.social_network.add_friend(1, 2)
+        self.social_network.notify_online(SocialPlayer(1), {3: 'player3'})
+        self.assertEqual(self.social_network._get_followers(2), set())
+        self.assertEqual(self.social_network._get_followers(3), {1})
+
+
+class NotificationBatchingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.social_network = SocialNetwork(friend_list_threshold=2)
+        self.players = {unique_id: SocialPlayer(unique_id) for unique_id in range(1, 5)}
+        for player in self.players.values():
+            self.social_network.notify_online(player, {})
+        self.social_network.flush_notifications()
+
+    def test_notifications_are_sent_on_flush(self):
+        self.social_network.add_friend(1, 2)
+        self.assertEqual(self.players[2].messages, [])
+
+        self.social_network.flush_notifications()
+        self.assertEqual([type(msg) for msg in self.players[2].messages], [a011b])
+        self.assertEqual(self.players[2].messages[0].findbytype(m020d).value, 1)
+
+    def test_repeated_changes_of_a_sender_collapse(self):
+        self.social_network.add_friend(1, 2)
+        self.social_network.notify_on_game_server(self.players[1])
+        self.social_network.flush_notifications()
+        self.assertEqual(len(self.players[2].messages), 1)
+        self.assertEqual(self.social_network.messages_saved(), 1)
+
+    def test_many_notifications_become_a_friend_list(self):
+        for friend_id in (2, 3, 4):
+            self.social_network.add_friend(1, friend_id)
+        self.social_network.flush_notifications()
+        self.assertEqual([type(msg) for msg in self.players[1].messages], [a011c])
+
+    def test_stats_report_what_was_saved(self):
+        for friend_id in (2, 3, 4):
+            self.social_network.add_friend(1, friend_id)
+        self.social_network.flush_notifications()
+        stats = self.social_network.notification_stats()
+        self.assertEqual(stats['friend_list_threshold'], 2)
+        self.assertEqual(stats['friend_lists_sent'], 1)
+        self.assertEqual(stats['messages_saved'], stats['notifications_requested'] - stats['messages_sent'])
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import queue
+import socket
+import struct
+import unittest
+
+from common.errors import RateLimitError
+from common.tcpmessage import TcpMessageReader, TcpMessageWriter
+from common.token_bucket import TokenBucket
+
+
+def frame(body, max_message_size=0xFFFF):
+    return struct.pack('<H', len(body) if len(body) < max_message_size else 0) + body
+
+
+class CountingSocket:
+    """ Socket wrapper that counts the number of reads """
+    def __init__(self, sock):
+        self.sock = sock
+        self.reads = 0
+
+    def recv(self, size):
+        self.reads += 1
+        return self.sock.recv(size)
+
+    def recv_into(self, buffer):
+        self.reads += 1
+        return self.sock.recv_into(buffer)
+
+
+class BufferedTcpMessageReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.receiving_sock, self.sending_sock = socket.socketpair()
+        self.sock = CountingSocket(self.receiving_sock)
+
+    def tearDown(self):
+        self.receiving_sock.close()
+        self.sending_sock.close()
+
+    def test_burst_of_messages_is_received_with_a_single_read(self):
+        messages = [b'message %d' % i for i in range(50)]
+        self.sending_sock.sendall(b''.join(frame(msg) for msg in messages))
+
+        reader = TcpMessageReader(self.sock, buffered=True)
+        self.assertEqual([reader.receive() for _ in messages], messages)
+        self.assertEqual(self.sock.reads, 1)
+
+    def test_messages_split_over_reads_are_reassembled(self):
+        messages = [bytes([i]) * 1450 for i in range(4)] + [b'short']
+        self.sending_sock.sendall(b''.join(frame(msg, max_message_size=1450) for msg in messages))
+
+        # The smallest possible buffer only holds a single message, so messages end up split over reads
+        reader = TcpMessageReader(self.sock, max_message_size=1450, buffered=True, buffer_size=0)
+        self.assertEqual([reader.receive() for _ in messages], messages)
+
+    def test_closed_connection_is_reported(self):
+        self.sending_sock.sendall(frame(b'complete') + b'\x10\x00incomplete')
+        self.sending_sock.close()
+        reader = TcpMessageReader(self.sock, buffered=True)
+        self.assertEqual(reader.receive(), b'complete')
+        with self.assertRaises(ConnectionResetError):
+            reader.receive()
+
+    def test_messages_are_dumped_with_their_size(self):
+        dump_queue = queue.Queue()
+        self.sending_sock.sendall(frame(b'first') + frame(b'second'))
+        reader = TcpMessageReader(self.sock, dump_queue=dump_queue, buffered=True)
+        reader.receive()
+        reader.receive()
+        self.assertEqual([dump_queue.get_nowait() for _ in range(2)],
+                         [('tcpreader', frame(b'first')), ('tcpreader', frame(b'second'))])
+
+    def test_every_message_is_charged_to_the_token_bucket(self):
+        self.sending_sock.sendall(frame(b'x' * 60) + frame(b'y' * 60))
+        reader = TcpMessageReader(self.sock, buffered=True, token_bucket=TokenBucket(None, 100, 3600))
+        self.assertEqual(reader.receive(), b'x' * 60)
+        with self.assertRaises(RateLimitError):
+            reader.receive()
+
+
+class PartialSendSocket:
+    """ Socket that sends at most a few bytes per call, to exercise the handling of partial sends """
+    def __init__(self, max_bytes_per_call):
+        self.max_bytes_per_call = max_bytes_per_call
+        self.sent = bytearray()
+        self.calls = 0
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        data = b''.join(buffers)[:self.max_bytes_per_call]
+        self.sent += data
+        return len(data)
+
+
+class SendallOnlySocket:
+    def __init__(self):
+        self.sent = bytearray()
+
+    def sendall(self, data):
+        self.sent += data
+
+
+class TcpMessageWriterTestCase(unittest.TestCase):
+    def expected_frames(self, data, max_message_size):
+        return b''.join(frame(data[i:i + max_message_size], max_message_size)
+                        for i in range(0, len(data), max_message_size))
+
+    def test_large_message_is_split_into_frames(self):
+        receiving_sock, sending_sock = socket.socketpair()
+        try:
+            data = bytes(range(256)) * 400
+            TcpMessageWriter(sending_sock, max_message_size=1450).send(data)
+            sending_sock.close()
+
+            reader = TcpMessageReader(receiving_sock, max_message_size=1450)
+            received = b''
+            while len(received) < len(data):
+                received += reader.receive()
+            self.assertEqual(received, data)
+        finally:
+            receiving_sock.close()
+
+    def test_partial_sends_are_continued(self):
+        data = bytes(range(256)) * 20
+        sock = PartialSendSocket(max_bytes_per_call=1000)
+        TcpMessageWriter(sock, max_message_size=1450).send(data)
+        self.assertEqual(bytes(sock.sent), self.expected_frames(data, 1450))
+        self.assertEqual(sock.calls, 6)
+
+    def test_sockets_without_sendmsg_use_sendall(self):
+        data = b'x' * 1450 + b'y'
+        sock = SendallOnlySocket()
+        TcpMessageWriter(sock, max_message_size=1450).send(data)
+        self.assertEqual(bytes(sock.sent), self.expected_frames(data, 1450))
+
+    def test_sent_frames_are_dumped(self):
+        dump_queue = queue.Queue()
+        data = b'z' * 3000
+        TcpMessageWriter(SendallOnlySocket(), max_message_size=1450, dump_queue=dump_queue).send(data)
+        self.assertEqual(dump_queue.get_nowait(), ('tcpwriter', self.expected_frames(data, 1450)))
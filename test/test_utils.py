@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2021  Maurice van der Pot <griffon26@kfk4ever.com>
+#
+# This file is part of taserver
+#
+# taserver is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# taserver is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with taserver.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+
+from common.utils import IdAllocator, IdentityCache
+
+
+class IdAllocatorTestCase(unittest.TestCase):
+    def test_allocates_consecutive_ids_from_minimum(self):
+        allocator = IdAllocator(5)
+        self.assertEqual([allocator.allocate() for _ in range(3)], [5, 6, 7])
+
+    def test_lowest_released_id_is_reused_first(self):
+        allocator = IdAllocator(0)
+        for _ in range(5):
+            allocator.allocate()
+        allocator.release(3)
+        allocator.release(1)
+        self.assertEqual([allocator.allocate() for _ in range(3)], [1, 3, 5])
+
+    def test_gaps_between_used_ids_are_filled_first(self):
+        allocator = IdAllocator(1, used_ids=[0, 2, 3, 6])
+        self.assertEqual([allocator.allocate() for _ in range(4)], [1, 4, 5, 7])
+
+    def test_gaps_are_kept_as_ranges(self):
+        allocator = IdAllocator(1, used_ids=[10 ** 9])
+        self.assertEqual(allocator.free_ranges, [(1, 10 ** 9)])
+        self.assertEqual([allocator.allocate() for _ in range(2)], [1, 2])
+        allocator.release(1)
+        allocator.release(2)
+        self.assertEqual(allocator.free_ranges, [(1, 10 ** 9)])
+
+    def test_released_ids_next_to_each_other_are_merged(self):
+        allocator = IdAllocator(0)
+        for _ in range(6):
+            allocator.allocate()
+        for number in (1, 3, 2, 5):
+            allocator.release(number)
+        self.assertEqual(allocator.free_ranges, [(1, 4), (5, 6)])
+        self.assertEqual([allocator.allocate() for _ in range(5)], [1, 2, 3, 5, 6])
+
+    def test_allocating_beyond_maximum_fails(self):
+        allocator = IdAllocator(1, 2)
+        allocator.allocate()
+        allocator.allocate()
+        with self.assertRaisesRegex(RuntimeError, 'between 1 and 2'):
+            allocator.allocate()
+
+    def test_releasing_an_unallocated_id_fails(self):
+        allocator = IdAllocator(0)
+        allocator.allocate()
+        allocator.release(0)
+        with self.assertRaises(ValueError):
+            allocator.release(0)
+        with self.assertRaises(ValueError):
+            allocator.release(1)
+
+
+class IdentityCacheTestCase(unittest.TestCase):
+    def test_value_is_computed_once_per_object(self):
+        computed = []
+        cache = IdentityCache(lambda obj: computed.append(obj) or len(computed), maxsize=2)
+        first, second = {'unhashable': 1}, {'unhashable': 1}
+        self.assertEqual([cache.get(first), cache.get(second), cache.get(first)], [1, 2, 1])
+        self.assertEqual(len(computed), 2)
+
+    def test_least_recently_used_object_is_forgotten(self):
+        cache = IdentityCache(lambda obj: object(), maxsize=2)
+        objects = [[1], [2], [3]]
+        first_value = cache.get(objects[0])
+        cache.get(objects[1])
+        cache.get(objects[0])
+        cache.get(objects[2])
+        self.assertEqual(len(cache.entries), 2)
+        self.assertIs(cache.get(objects[0]), first_value)
+        self.assertNotIn(id(objects[1]), cache.entries)